@@ -1,14 +1,13 @@
-from dataclasses import dataclass
-from typing import Optional, Callable, List, Tuple, Dict, Coroutine, Any, Awaitable
+import time
+from collections import Counter, defaultdict
+from typing import Optional, Callable, List, Tuple, Dict, Awaitable, Protocol, Sequence
 
 from discord import app_commands
 from fuzzywuzzy import fuzz, process
 
+from amelia.metrics import CacheStats, registry
 
-@dataclass()
-class AutoCompleteItem:
-    param_value: str
-    choices_cache: List[app_commands.Choice]
+DISCORD_CHOICE_LIMIT = 25
 
 
 def fuzzy_ratio(text: str, names: Tuple[str, ...]):
@@ -24,43 +23,157 @@ def fuzzy_best(text: str, items: List[str], threshold: int) -> List[str]:
     return [r[0] for r in ratios if highest_ratio - r[1] < threshold]
 
 
-class FuzzyChoicesCache:
+def _normalize(text: str) -> str:
+    return ''.join(ch for ch in text.upper() if ch.isalnum())
 
-    def __init__(self, fetch_method: Callable[[], Awaitable[list[str]]], threshold: int = 7):
-        self.fetch_method = fetch_method
-        self.threshold = threshold
-        self.cache: List[str] = []
 
-    async def refresh(self):
-        self.cache = await self.fetch_method()
-
-    async def retrieve(self, fuzzy_string: str) -> List[app_commands.Choice]:
-        if not self.cache:
-            self.cache = await self.fetch_method()
-        best_matches = fuzzy_best(fuzzy_string, self.cache, self.threshold)
-        return [app_commands.Choice(name=c, value=c) for c in self.cache if c in best_matches]
+def _within_threshold(ratios: List[Tuple[str, int]], threshold: int, limit: int) -> List[str]:
+    if not ratios:
+        return []
+    highest_ratio = ratios[0][1]
+    return [r[0] for r in ratios if highest_ratio - r[1] < threshold][:limit]
+
+
+class Matcher(Protocol):
+
+    def index(self, items: Sequence[str]) -> None:
+        ...
+
+    def match(self, text: str, threshold: int, limit: int = DISCORD_CHOICE_LIMIT) -> List[str]:
+        """
+        Returns the best matching items in ranked order. Only items scoring within ``threshold``
+        of the best match are returned, and never more than ``limit``.
+        """
+        ...
+
+
+class ScanMatcher:
+    """
+    Scores every item on each match. Fine for short lists such as a single airport's plates.
+    """
+
+    def __init__(self):
+        self.items: List[str] = []
+
+    def index(self, items: Sequence[str]) -> None:
+        self.items = list(items)
+
+    def match(self, text: str, threshold: int, limit: int = DISCORD_CHOICE_LIMIT) -> List[str]:
+        if not _normalize(text):
+            return self.items[:limit]
+        ratios = process.extract(text, self.items, scorer=fuzz.partial_ratio, limit=limit)
+        return _within_threshold(ratios, threshold, limit)
+
+
+class NGramMatcher:
+    """
+    Shortlists candidates through a prefix and n-gram index before scoring, so that
+    large lists (ie: every ICAO with plates) are not fully scanned on every keystroke.
+
+    Queries shorter than ``n`` are answered by prefix, then by a substring scan so that ie:
+    'LA' still finds KLAX. Longer queries rank items by the number of n-grams they share
+    with the query and only the top ``shortlist`` are scored.
+    """
+
+    def __init__(self, n: int = 3, shortlist: int = 200):
+        self.n = n
+        self.shortlist = shortlist
+        self.items: List[str] = []
+        self._keys: List[str] = []
+        self._prefixes: Dict[str, List[int]] = {}
+        self._grams: Dict[str, List[int]] = {}
+
+    def _ngrams(self, key: str) -> set[str]:
+        return {key[i:i + self.n] for i in range(len(key) - self.n + 1)}
+
+    def index(self, items: Sequence[str]) -> None:
+        prefixes: Dict[str, List[int]] = defaultdict(list)
+        grams: Dict[str, List[int]] = defaultdict(list)
+        for idx, item in enumerate(items):
+            key = _normalize(item)
+            for size in range(1, self.n):
+                if len(key) >= size:
+                    prefixes[key[:size]].append(idx)
+            for gram in self._ngrams(key):
+                grams[gram].append(idx)
+        self.items = list(items)
+        self._keys = [_normalize(item) for item in items]
+        self._prefixes = dict(prefixes)
+        self._grams = dict(grams)
+
+    def _candidates(self, key: str) -> List[int]:
+        if len(key) < self.n:
+            candidates = self._prefixes.get(key, [])[:self.shortlist]
+            if len(candidates) < self.shortlist:
+                # Prefix matches rank first, the scan only fills the rest of the shortlist
+                seen = set(candidates)
+                for idx, item_key in enumerate(self._keys):
+                    if key in item_key and idx not in seen:
+                        candidates.append(idx)
+                        if len(candidates) >= self.shortlist:
+                            break
+            return candidates
+        counts: Counter[int] = Counter()
+        for gram in self._ngrams(key):
+            counts.update(self._grams.get(gram, ()))
+        return [idx for idx, _ in counts.most_common(self.shortlist)]
+
+    def match(self, text: str, threshold: int, limit: int = DISCORD_CHOICE_LIMIT) -> List[str]:
+        key = _normalize(text)
+        if not key:
+            return self.items[:limit]
+        candidates = [self.items[idx] for idx in self._candidates(key)]
+        if not candidates:
+            return []
+        ratios = process.extract(text, candidates, scorer=fuzz.partial_ratio, limit=limit)
+        return _within_threshold(ratios, threshold, limit)
+
+
+def fuzzy_choices(text: str, choices: List[app_commands.Choice], threshold: int) -> List[app_commands.Choice]:
+    if not choices:
+        return []
+    by_name = {c.name: c for c in choices}
+    matcher = ScanMatcher()
+    matcher.index(list(by_name.keys()))
+    return [by_name[name] for name in matcher.match(text, threshold)]
 
 
-class DependentFuzzyChoicesCache:
+class FuzzyChoicesCache:
 
     def __init__(
-            self, 
-            fetch_method: Callable[[Any], Coroutine[None, Any, AutoCompleteItem]], 
-            sanitizer: Optional[Callable[[str], str]] = None, 
-            threshold: int = 7
+            self,
+            fetch_method: Callable[[], Awaitable[list[str]]],
+            threshold: int = 7,
+            matcher: Optional[Matcher] = None,
+            name: Optional[str] = None
     ):
         self.fetch_method = fetch_method
         self.threshold = threshold
-        self.sanitizer = sanitizer or (lambda s: s)
-        self.cache: Dict[int, AutoCompleteItem] = {}
-
-    async def retrieve(self, key: int, param_value: str, fuzzy_string: str) -> List[app_commands.Choice]:
-        cache = self.cache.get(key)
-        value_is_different = cache and cache.param_value != param_value
-        if cache is None or value_is_different:
-            self.cache[key] = cache = await self.fetch_method(param_value)
-        best_matches = fuzzy_best(fuzzy_string, [c.name for c in cache.choices_cache], self.threshold)
-        return [c for c in cache.choices_cache if c.name in best_matches]
-
+        self.matcher: Matcher = matcher or NGramMatcher()
+        self.cache: List[str] = []
+        self._choices: Dict[str, app_commands.Choice] = {}
+        self.stats = CacheStats(size_of=lambda: len(self.cache))
+        if name is not None:
+            registry.register_cache(name, self.stats)
+
+    def _load(self, items: List[str]):
+        self.cache = items
+        self.matcher.index(items)
+        self._choices = {c: app_commands.Choice(name=c, value=c) for c in items}
+
+    async def _fetch(self) -> List[str]:
+        started = time.perf_counter()
+        items = await self.fetch_method()
+        self.stats.record_load(time.perf_counter() - started)
+        return items
 
+    async def refresh(self):
+        self._load(await self._fetch())
 
+    async def retrieve(self, fuzzy_string: str) -> List[app_commands.Choice]:
+        if self.cache:
+            self.stats.hits += 1
+        else:
+            self.stats.misses += 1
+            self._load(await self._fetch())
+        return [self._choices[name] for name in self.matcher.match(fuzzy_string, self.threshold)]
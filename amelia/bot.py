@@ -6,6 +6,7 @@ from typing import TYPE_CHECKING
 from discord.app_commands import Group
 from discord.ext import commands
 
+from .render import RenderService
 from .tfl import TFLService
 
 from .uow import UOW
@@ -21,6 +22,7 @@ class AmeliaBot(commands.Bot):
     def __init__(self, db_service: Pg, **kwargs):
         super(AmeliaBot, self).__init__(**kwargs)
         self.tfl = TFLService()
+        self.renderer = RenderService()
         db_service.uow_cls = UOW
         self.db: Pg[UOW] = db_service
 
@@ -34,8 +36,14 @@ class AmeliaBot(commands.Bot):
 
 
     async def setup_hook(self) -> None:
+        await self.tfl.start()
         await self.load_extension('amelia.features.core')
 
+    async def close(self) -> None:
+        await super(AmeliaBot, self).close()
+        await self.tfl.close()
+        self.renderer.close()
+
 
     async def on_ready(self):
         if self._first_run:
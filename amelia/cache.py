@@ -1,10 +1,16 @@
 from __future__ import annotations
 import collections
 import logging
+from datetime import datetime, timedelta, timezone
 from typing import TypeVar, Generic, Dict, Optional, Protocol, Any, OrderedDict, \
-    TypeAlias
+    TypeAlias, Callable, Tuple, Set, Hashable, NamedTuple
 from functools import wraps
-import gc
+import sys
+import time
+import weakref
+
+from .metrics import CacheStats, registry
+from .singleflight import SingleFlight
 log = logging.getLogger(__name__)
 
 
@@ -23,137 +29,560 @@ T = TypeVar("T", bound=Indexable | Attritable)
 OneOrManyT: TypeAlias = T | list[T]
 
 
+def approximate_size(value: Any) -> int:
+    """
+    A rough, shallow-ish byte count of a cached value. Good enough to bound a cache by
+    weight, not meant to be exact.
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        return size + sum(approximate_size(v) for v in value.values())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return size + sum(approximate_size(v) for v in value)
+    attributes = getattr(value, '__dict__', None)
+    if attributes is not None:
+        size += sum(sys.getsizeof(v) for v in attributes.values())
+    for name in getattr(type(value), '__slots__', ()):
+        size += sys.getsizeof(getattr(value, name, None))
+    return size
+
+
+class FunctionKey(NamedTuple):
+    """
+    The cache key of a function call. The arguments themselves are part of the key so two
+    different calls can never share an entry through a hash collision.
+    """
+    module: str
+    qualname: str
+    args: Tuple[Any, ...]
+    kwargs: Tuple[Tuple[str, Any], ...]
+
+
+class _Negative:
+    """
+    Marks a cached ``None`` result, so that "nothing there" lookups are cached too.
+    """
+
+    def __repr__(self) -> str:
+        return '<negative>'
+
+
+NEGATIVE = _Negative()
+
+
+class _Entry:
+    __slots__ = ('value', 'expires', 'weight')
+
+    def __init__(self, value: Any, expires: Optional[float], weight: int):
+        self.value = value
+        self.expires = expires
+        self.weight = weight
+
+
+_live_caches: weakref.WeakSet[LRUCache] = weakref.WeakSet()
+
+
+def sweep_caches() -> int:
+    """
+    Sweeps expired entries out of every live cache. Returns the number removed.
+    """
+    return sum(cache.sweep() for cache in list(_live_caches))
+
+
 class LRUCache(Generic[T]):
+    """
+    A least recently used cache bounded by entry count and optionally by weight.
 
-    def __init__(self, max_size: Optional[int] = 128):
+    Entries may expire. ``ttl`` is the default lifetime in seconds, and can be overridden
+    per ``put``. Expired entries are dropped lazily when read. Reads and writes also sweep
+    out entries that were never read again, at most every ``sweep_interval`` seconds. That
+    sweep is opportunistic, so idle caches rely on ``sweep_caches`` being run on a timer. When ``max_weight`` is set,
+    entries are weighed with ``sizer`` (approximate bytes by default) and the least
+    recently used are evicted until the total fits.
+
+    Caches given a ``name`` publish their ``stats`` to the metrics registry.
+
+    Loads through ``function`` are guarded by generations. Every invalidation bumps an
+    epoch, and a load that was running while something it may have read got invalidated
+    returns its result without caching it. Otherwise a change notification arriving mid
+    load would be overwritten by the stale result.
+    """
+
+    def __init__(
+            self,
+            max_size: Optional[int] = 128,
+            ttl: Optional[float] = None,
+            max_weight: Optional[int] = None,
+            sizer: Optional[Callable[[Any], int]] = None,
+            sweep_interval: float = 60,
+            timer: Callable[[], float] = time.monotonic,
+            name: Optional[str] = None
+    ):
+        self.name = name
         self.max_size = max_size
-        self._cache: OrderedDict[Any, OneOrManyT] = collections.OrderedDict()
-        self.last_function_id: Optional[int] = None
+        self.ttl = ttl
+        self.max_weight = max_weight
+        self.sizer = sizer or approximate_size
+        self.sweep_interval = sweep_interval
+        self.timer = timer
+        self.total_weight = 0
+        self._cache: OrderedDict[Any, _Entry] = collections.OrderedDict()
+        self._last_sweep = timer()
+        self._flights = SingleFlight(cancel_abandoned=True)
+        self.last_function_id: Optional[Hashable] = None
+        self.stats = CacheStats(size_of=lambda: len(self._cache), weight_of=lambda: self.total_weight)
+        self._epoch = 0
+        # Keys currently being loaded -> how many loads are in flight for them. Callers with
+        # different contexts (connections) load separately, so there may be several.
+        self._loading: Dict[Any, int] = {}
+        # Keys invalidated while loading -> the epoch of the last invalidation.
+        self._loading_invalidated: Dict[Any, int] = {}
+        if name is not None:
+            registry.register_cache(name, self.stats)
+        _live_caches.add(self)
 
-    def put(self, key: str | int, value: OneOrManyT):
-        self._cache[key] = value
-        self._cache.move_to_end(key)
+    def _pack(self, value: OneOrManyT) -> Any:
+        # How a value is held internally. Subclasses may store a different structure.
+        return value
+
+    def _unpack(self, stored: Any) -> OneOrManyT:
+        return stored
+
+    def _on_remove(self, key: Any):
+        # Called whenever a key leaves the cache, whether evicted or invalidated.
+        pass
+
+    def _on_clear(self):
+        pass
+
+    def _weigh(self, value: OneOrManyT) -> int:
+        return self.sizer(value) if self.max_weight is not None else 0
+
+    def _reweigh(self, entry: _Entry):
+        # For entries whose value was changed in place.
+        weight = self._weigh(self._unpack(entry.value))
+        self.total_weight += weight - entry.weight
+        entry.weight = weight
+
+    def _expired(self, entry: _Entry, now: float) -> bool:
+        return entry.expires is not None and entry.expires <= now
+
+    def _remove(self, key: Any):
+        entry = self._cache.pop(key)
+        self.total_weight -= entry.weight
+        self._on_remove(key)
+
+    def _bump(self) -> int:
+        self._epoch += 1
+        return self._epoch
+
+    def _invalidate_loading(self, key: Optional[Any] = None):
+        # Marks in flight loads as stale. All of them when no key is given.
+        if key is None:
+            for k in self._loading:
+                self._loading_invalidated[k] = self._bump()
+        elif key in self._loading:
+            self._loading_invalidated[key] = self._bump()
+
+    def _stale_result(self, started: int, item: Any) -> bool:
+        # Whether a finished load may hold data invalidated after it started.
+        return False
+
+    def _on_loads_settled(self):
+        # Called when no loads are left in flight.
+        pass
+
+    def _maybe_sweep(self):
+        if self.timer() - self._last_sweep >= self.sweep_interval:
+            self.sweep()
+
+    def sweep(self) -> int:
+        """
+        Removes every expired entry. Returns the number removed.
+        """
+        now = self.timer()
+        self._last_sweep = now
+        expired = [k for k, e in self._cache.items() if self._expired(e, now)]
+        for key in expired:
+            self._remove(key)
+        self.stats.expirations += len(expired)
+        return len(expired)
+
+    def _over_capacity(self) -> bool:
         if self.max_size is not None and len(self._cache) > self.max_size:
-            self._cache.popitem(last=False)
+            return True
+        return self.max_weight is not None and self.total_weight > self.max_weight
 
-    def invalidate(self, key: str | int):
+    def put(self, key: Hashable, value: OneOrManyT, ttl: Optional[float] = None):
+        self._maybe_sweep()
+        if key in self._cache:
+            self._remove(key)
+        ttl = self.ttl if ttl is None else ttl
+        expires = None if ttl is None else self.timer() + ttl
+        weight = self._weigh(value)
+        self._cache[key] = _Entry(self._pack(value), expires, weight)
+        self.total_weight += weight
+        while self._cache and self._over_capacity():
+            evicted = next(iter(self._cache))
+            self._remove(evicted)
+            self.stats.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        self._invalidate_loading(key)
         if key in self._cache.keys():
-            del self._cache[key]
+            self._remove(key)
+            self.stats.invalidations += 1
 
-    def get(self, key: str | int) -> Optional[OneOrManyT]:
-        if key not in self._cache:
+    def get(self, key: Hashable) -> Optional[OneOrManyT]:
+        self._maybe_sweep()
+        entry = self._cache.get(key)
+        if entry is None:
+            self.stats.misses += 1
+            return None
+        if self._expired(entry, self.timer()):
+            self._remove(key)
+            self.stats.expirations += 1
+            self.stats.misses += 1
             return None
         self._cache.move_to_end(key)
-        return self._cache[key]
+        self.stats.hits += 1
+        return self._unpack(entry.value)
 
-    def preview(self, key: str | int) -> Optional[OneOrManyT]:
+    def preview(self, key: Hashable) -> Optional[OneOrManyT]:
         # Does not invoke business rules or mutate the internal OrderedDict
-        if key not in self._cache:
+        entry = self._cache.get(key)
+        if entry is None or self._expired(entry, self.timer()):
             return None
-        return self._cache[key]
+        return self._unpack(entry.value)
+
+    def invalidate_negative(self):
+        """
+        Drops every cached ``None`` result. Useful when rows are inserted, since a new row
+        cannot be matched to the negative entries it makes stale.
+        """
+        self._invalidate_loading()
+        for key in [k for k, e in self._cache.items() if e.value is NEGATIVE]:
+            self._remove(key)
+            self.stats.invalidations += 1
 
     def clear(self):
+        # Dropping the dict is enough, there is no need for a full gc pass here.
+        self._invalidate_loading()
+        self.stats.invalidations += len(self._cache)
         self._cache = collections.OrderedDict()
-        gc.collect()
+        self.total_weight = 0
+        self._on_clear()
 
     @property
     def cache_ids(self):
         return self._cache.keys()
 
-    def function(self, class_level: bool = False):
+    async def _load(self, key: Any, func: Callable, args: tuple, kwargs: dict, negative_ttl: Optional[float]):
+        epoch = self._epoch
+        self._loading[key] = self._loading.get(key, 0) + 1
+        started = time.perf_counter()
+        try:
+            item = await func(*args, **kwargs)
+            stale = self._loading_invalidated.get(key, epoch) > epoch or self._stale_result(epoch, item)
+        finally:
+            self._loading[key] -= 1
+            if not self._loading[key]:
+                del self._loading[key]
+                self._loading_invalidated.pop(key, None)
+            if not self._loading:
+                self._on_loads_settled()
+        self.stats.record_load(time.perf_counter() - started)
+        if stale:
+            log.debug(f"{key} was invalidated while loading, not caching the result")
+        elif item is not None:
+            self.put(key, item)
+        elif negative_ttl is not None:
+            self.put(key, NEGATIVE, ttl=negative_ttl)
+        return item
+
+    def function(
+            self,
+            class_level: bool = False,
+            negative_ttl: Optional[float] = None,
+            key: Optional[Callable[..., Hashable]] = None
+    ):
+        """
+        Caches the results of a coroutine function.
+
+        Calls are keyed on the function's module, qualified name and arguments (excluding
+        ``self`` when ``class_level``). ``key`` may be given to build the argument part of the
+        key instead. Calls whose arguments cannot be hashed are not cached.
+
+        ``None`` results are only cached when ``negative_ttl`` (seconds) is given, and then
+        only for that long. Concurrent misses for the same key share a single call. With
+        ``class_level`` only callers on the same instance share it, since the call runs on that
+        instance's connection. When every waiter is cancelled the shared call is cancelled too.
+
+        The decorated function gets a ``cached`` attribute to look up a result without calling it.
+        """
         
         def decorator(func):
+            def make_key(arguments: tuple, kwargs: dict) -> Optional[FunctionKey]:
+                if key is not None:
+                    cache_key = FunctionKey(func.__module__, func.__qualname__, (key(*arguments, **kwargs),), ())
+                else:
+                    cache_key = FunctionKey(
+                        func.__module__, func.__qualname__, arguments, tuple(sorted(kwargs.items()))
+                    )
+                try:
+                    hash(cache_key)
+                except TypeError:
+                    log.debug(f"unhashable arguments for {func.__qualname__}, not caching")
+                    return None
+                return cache_key
+
             @wraps(func)
             async def wrapper(*args, **kwargs):
                 arguments = args[1:] if class_level else args
-                key = hash((func.__name__, arguments, frozenset(kwargs.items())))
-                item = self._cache.get(key)
+                cache_key = make_key(arguments, kwargs)
+                if cache_key is None:
+                    return await func(*args, **kwargs)
+                self.last_function_id = cache_key
+                item = self.get(cache_key)
+                if item is NEGATIVE:
+                    return None
                 if item is None:
-                    log.debug(f'function cache miss detected {key} / {func.__name__}')
-                    item = await func(*args, **kwargs)
-                    if item is not None:
-                        self.put(key, item)
-                else:
-                    log.debug(f"cache hit {item} / {key}")
-                self.last_function_id = key
-                self.post_function_cache(key, item)
+                    flight_key = (cache_key, id(args[0])) if class_level else cache_key
+                    item = await self._flights.do(flight_key, self._load, cache_key, func, args, kwargs, negative_ttl)
+                    if isinstance(item, list):
+                        # Callers sharing an in-flight load each get their own list
+                        item = list(item)
                 return item
+
+            def cached(*arguments, **kwargs):
+                """
+                The cached result for these arguments (without ``self``), or None when the
+                function would have to be called. Lets callers skip setting up a call on a hit.
+                """
+                cache_key = make_key(arguments, kwargs)
+                if cache_key is None:
+                    return None
+                value = self.preview(cache_key)
+                if value is None or value is NEGATIVE:
+                    return None
+                return self.get(cache_key)
+
+            wrapper.cached = cached
             return wrapper
         return decorator
 
-    def post_function_cache(self, key: int, item: T | list[T]):
-        pass
+
+class _KeyedResult(OrderedDict):
+    """
+    A cached list result, held as identifier -> object so single objects can be
+    updated or removed in place.
+    """
 
 
 class FunctionOperationsCache(LRUCache[T]):
+    """
+    A function cache that also knows which cached results contain which objects, so that
+    a single object can be updated or invalidated across every cached result holding it.
 
-    def __init__(self, item_identifier_field: str, max_size: int=128):
-        super().__init__(max_size=max_size)
-        self.object_map: Dict[int, set] = {}
+    ``object_map`` and ``function_map`` form a two way index between object identifiers
+    and function cache keys. Both are cleaned up whenever a key leaves the cache so they
+    stay bounded by ``max_size``.
+
+    Objects are versioned by ``version_field``. An update never replaces a cached object
+    with an older version of it, so refetches that complete out of order are harmless.
+
+    ``item_identifier_field`` may be a tuple of fields when one field is not unique across
+    everything in the cache, ie: rows from several tables sharing ids. The identifier is
+    then the tuple of their values.
+    """
+
+    def __init__(
+            self,
+            item_identifier_field: str | Tuple[str, ...],
+            max_size: Optional[int] = 128,
+            version_field: Optional[str] = 'updated_at',
+            **kwargs: Any
+    ):
+        super().__init__(max_size=max_size, **kwargs)
+        self.object_map: Dict[Any, Set[Any]] = {}
+        self.function_map: Dict[Any, Set[Any]] = {}
         self._field_name = item_identifier_field
+        self._version_field = version_field
+        # Object identifiers invalidated while loads were in flight -> the epoch they were at.
+        self._invalidated: Dict[Any, int] = {}
 
-    def _get_identifier(self, obj: T) -> Any:
-        value = None
+    @staticmethod
+    def _get_field(obj: T, field_name: str) -> Any:
         try:
-            value = getattr(obj, self._field_name)
+            return getattr(obj, field_name)
         except AttributeError:
             try:
-                value = obj[self._field_name] #type: ignore
+                return obj[field_name] #type: ignore
             except (TypeError, KeyError):
-                raise AttributeError
-        finally:
-            return value
+                return None
+
+    def _get_identifier(self, obj: T) -> Any:
+        if isinstance(self._field_name, tuple):
+            values = tuple(self._get_field(obj, f) for f in self._field_name)
+            return None if None in values else values
+        return self._get_field(obj, self._field_name)
+
+    def _is_older(self, obj: T, current: Any) -> bool:
+        if self._version_field is None or current is None:
+            return False
+        version = self._get_field(obj, self._version_field)
+        current_version = self._get_field(current, self._version_field)
+        if version is None or current_version is None:
+            return False
+        return version < current_version
+
+    def _mark_invalidated(self, id_value: Any):
+        if self._loading:
+            self._invalidated[id_value] = self._bump()
 
-    def _map_scalar(self, object: T, function_cache_id: int):
-        id_value = self._get_identifier(object)
-        if id_value not in self.object_map.keys():
-            self.object_map[id_value] = set()
-        self.object_map[id_value].add(function_cache_id)
+    def _stale_result(self, started: int, item: Any) -> bool:
+        if not self._invalidated:
+            return False
+        if item is None:
+            # Can't tell which rows a missing result depends on
+            return any(epoch > started for epoch in self._invalidated.values())
+        items = item if isinstance(item, list) else [item]
+        return any(self._invalidated.get(self._result_key(obj), started) > started for obj in items)
 
-    def _map_sequence(self, objects: list[T], function_cache_id: int):
-        for obj in objects:
-            self._map_scalar(obj, function_cache_id)
+    def _on_loads_settled(self):
+        self._invalidated = {}
 
-    def post_function_cache(self, key: int, result_set: OneOrManyT):
-        if isinstance(result_set, list):
-            self._map_sequence(result_set, key)
+    def _result_key(self, obj: T) -> Any:
+        identifier = self._get_identifier(obj)
+        return id(obj) if identifier is None else identifier
+
+    def _pack(self, value: OneOrManyT) -> Any:
+        if isinstance(value, list):
+            return _KeyedResult((self._result_key(obj), obj) for obj in value)
+        return value
+
+    def _unpack(self, stored: Any) -> OneOrManyT:
+        if isinstance(stored, _KeyedResult):
+            return list(stored.values())
+        return stored
+
+    def _map(self, function_cache_id: Any, stored: Any):
+        if stored is NEGATIVE:
+            return
+        if isinstance(stored, _KeyedResult):
+            ids = set(stored.keys())
         else:
-            self._map_scalar(result_set, key)
-
-#TODO: Refactor two functions below as they are very similar.
-    def invalidate_function_cache_object(self, field_id: int):
-        function_ids = self.object_map.get(field_id, set())
-        for fid in function_ids:
-            value = self.get(fid)
-            if value is None:
-                return
-            if isinstance(value, list):
-                # Loop through and remove only that one object
-                for obj in value: # list
-                    obj_id = self._get_identifier(obj)
-                    if obj_id == field_id:
-                        value.remove(obj)
-                        self.put(fid, value)
+            ids = {self._result_key(stored)}
+        self.function_map[function_cache_id] = ids
+        for id_value in ids:
+            self.object_map.setdefault(id_value, set()).add(function_cache_id)
+
+    def _on_remove(self, key: Any):
+        for id_value in self.function_map.pop(key, ()):
+            function_ids = self.object_map.get(id_value)
+            if function_ids is None:
+                continue
+            function_ids.discard(key)
+            if not function_ids:
+                del self.object_map[id_value]
+
+    def _on_clear(self):
+        self.object_map = {}
+        self.function_map = {}
+
+    def put(self, key: Hashable, value: OneOrManyT, ttl: Optional[float] = None):
+        super().put(key, value, ttl=ttl)
+        if key in self._cache:
+            self._map(key, self._cache[key].value)
+
+    def invalidate_function_cache_object(self, field_id: Any):
+        self._mark_invalidated(field_id)
+        for fid in self.object_map.pop(field_id, set()):
+            entry = self._cache.get(fid)
+            if entry is None:
+                continue
+            if isinstance(entry.value, _KeyedResult):
+                # Remove only that one object from the cached result
+                entry.value.pop(field_id, None)
+                self.function_map[fid].discard(field_id)
+                self._reweigh(entry)
+                self.stats.invalidations += 1
             else:
                 self.invalidate(fid)
-        if field_id in self.object_map.keys():
-            del self.object_map[field_id]
 
     def update_function_cache_object(self, object: T):
         oid = self._get_identifier(object)
-        function_ids = self.object_map.get(oid, set())
-        for fid in function_ids:
-            value = self.get(fid)
-            if value is None:
-                return None
-            if isinstance(value, list):
-                # Loop through and remove only that one object
-                for obj in value: # list
-                    obj_id = self._get_identifier(obj)
-                    if obj_id == oid:
-                        idx = value.index(obj)
-                        value.remove(obj)
-                        value.insert(idx, object)
-                        self.put(fid, value)
+        self._mark_invalidated(oid)
+        for fid in self.object_map.get(oid, set()):
+            entry = self._cache.get(fid)
+            if entry is None:
+                continue
+            if isinstance(entry.value, _KeyedResult):
+                if self._is_older(object, entry.value.get(oid)):
+                    continue
+                entry.value[oid] = object
+            elif self._is_older(object, entry.value):
+                continue
             else:
-                self.put(fid, object)
+                entry.value = object
+            self._reweigh(entry)
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class ReportCache(LRUCache[T]):
+    """
+    Caches upstream reports (METAR/TAF) by station.
+
+    Entries do not use a fixed wall clock TTL. A report expires ``max_age`` after its own
+    observation/issue time, but is always kept for at least ``min_ttl`` so that stations which
+    report irregularly are not fetched on every request.
+    """
+
+    def __init__(
+            self,
+            observed_at: Callable[[T], datetime],
+            max_age: timedelta,
+            min_ttl: timedelta = timedelta(minutes=2),
+            max_size: Optional[int] = 1024,
+            clock: Callable[[], datetime] = utcnow,
+            name: Optional[str] = None
+    ):
+        super().__init__(max_size=max_size, name=name)
+        self.observed_at = observed_at
+        self.max_age = max_age
+        self.min_ttl = min_ttl
+        self.clock = clock
+
+    def expires_at(self, report: T) -> datetime:
+        observed = self.observed_at(report)
+        if observed.tzinfo is None:
+            observed = observed.replace(tzinfo=timezone.utc)
+        return max(observed + self.max_age, self.clock() + self.min_ttl)
+
+    def put(self, key: Hashable, value: T, ttl: Optional[float] = None):
+        # An explicit ttl (seconds) overrides the expiry taken from the report itself.
+        expires = self.expires_at(value) if ttl is None else self.clock() + timedelta(seconds=ttl)
+        super().put(key, (value, expires))
+
+    def entry(self, key: Hashable) -> Optional[Tuple[T, bool]]:
+        """
+        Returns the cached report and whether it is still fresh, regardless of expiry.
+        """
+        entry: Optional[Tuple[T, datetime]] = super().get(key) # type: ignore
+        if entry is None:
+            return None
+        report, expires = entry
+        return report, self.clock() < expires
+
+    def get(self, key: Hashable) -> Optional[T]:
+        entry = self.entry(key)
+        if entry is None or not entry[1]:
+            return None
+        return entry[0]
+
+    def preview(self, key: Hashable) -> Optional[T]:
+        entry = super().preview(key)
+        return None if entry is None else entry[0] # type: ignore
@@ -1,64 +1,119 @@
 from __future__ import annotations
 
 import asyncio
+import os
 from datetime import datetime, timezone
 
 import discord
 from discord.ext import commands
-from typing import TYPE_CHECKING, Dict, Optional, AsyncGenerator
+from typing import TYPE_CHECKING, Dict, Optional, List
 from discord.ext import tasks
 
+import asyncpg
+
 from .data import GuildSchema
+from .joins import join_pipeline
+from .member_counts import MemberCountBuffer
 import logging
 
 if TYPE_CHECKING:
     from bot import AmeliaBot
 
 log = logging.getLogger(__name__)
+
+# How many guilds have their counts fetched at once. discord.py waits out rate limits
+# itself, this only keeps the refresh from taking the whole REST budget.
+GUILD_REFRESH_CONCURRENCY = int(os.environ.get('GUILD_REFRESH_CONCURRENCY', 4))
+# 'gateway' trusts the member counts the gateway keeps for chunked guilds, 'rest' always asks the API.
+MEMBER_COUNT_SOURCE = os.environ.get('GUILD_MEMBER_COUNT_SOURCE', 'gateway')
+MEMBER_COUNT_FLUSH_INTERVAL = float(os.environ.get('MEMBER_COUNT_FLUSH_INTERVAL', 30))
+
+
 class GuildFeatures(commands.Cog):
 
     def __init__(self, bot: AmeliaBot):
         self.bot = bot
+        self.member_counts = MemberCountBuffer()
+        # Delta flushes and the absolute refresh must not interleave, or deltas get counted twice.
+        self.member_counts_lock = asyncio.Lock()
 
     async def cog_load(self) -> None:
         log.info("Starting task to update guild information")
         self.update_guilds_task.start()
+        self.flush_member_counts_task.start()
+        join_pipeline.start()
 
     async def cog_unload(self) -> None:
         self.update_guilds_task.cancel()
+        self.flush_member_counts_task.cancel()
+        await join_pipeline.close()
+        # Write out whatever is still buffered, this also runs when the bot closes.
+        await self.flush_member_counts()
+
+    @staticmethod
+    def gateway_member_count(guild: discord.Guild) -> Optional[int]:
+        # With the members intent the gateway keeps member_count current through joins and
+        # leaves. It is only trusted once the guild is chunked and the cache is complete.
+        if guild.chunked and guild.member_count is not None:
+            return guild.member_count
+        return None
 
     async def member_count(self, guild: discord.Guild, fetch: bool = False) -> Optional[int]:
+        if MEMBER_COUNT_SOURCE == 'gateway':
+            count = self.gateway_member_count(guild)
+            if count is not None:
+                return count
         count = guild.approximate_member_count
         if count is None or fetch:
             fetched_guild = await self.bot.fetch_guild(guild.id, with_counts=True)
             count = fetched_guild.approximate_member_count
         return count
 
-    async def collect_guild_member_counts(self, delay: int = 1) -> Dict[int, int]:
-        container = {}
-        for cached_guild in self.bot.guilds:
-            count = await self.member_count(cached_guild, fetch=True)
-            container[cached_guild.id] = count
-            await asyncio.sleep(delay)
-        return container
-    async def get_guild_schemas(self, delay: int = 1) -> AsyncGenerator[GuildSchema, None, None]:
-        for g in self.bot.guilds:
-            count = await self.member_count(g, fetch=True) 
-            yield GuildSchema(
+    async def collect_guild_member_counts(
+            self,
+            concurrency: int = GUILD_REFRESH_CONCURRENCY
+    ) -> Dict[int, Optional[int]]:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def collect(guild: discord.Guild) -> Optional[int]:
+            async with semaphore:
+                try:
+                    count = await self.member_count(guild, fetch=True)
+                except discord.HTTPException as e:
+                    log.warning(f"Could not fetch member count for {guild.id}: {e}")
+                    count = guild.member_count
+                if count is not None:
+                    # Joins and leaves buffered up to now are part of this count
+                    self.member_counts.discard(guild.id)
+                return count
+
+        guilds = list(self.bot.guilds)
+        counts = await asyncio.gather(*(collect(g) for g in guilds))
+        return {g.id: count for g, count in zip(guilds, counts)}
+
+    async def get_guild_schemas(self) -> List[GuildSchema]:
+        counts = await self.collect_guild_member_counts()
+        return [
+            GuildSchema(
                 guild_id=g.id,
-                member_count=count,
+                member_count=counts.get(g.id),
                 vanity_url=g.vanity_url,
                 guild_name=g.name,
                 joined=g.me.joined_at
             )
+            for g in self.bot.guilds
+        ]
+
     @tasks.loop(hours=6, reconnect=True)
     async def update_guilds_task(self):
         await self.bot.wait_until_ready()
-        async with self.bot.db as session:
-            async for schema in self.get_guild_schemas():
-                await session.guilds.upsert(schema)
-            await session.commit()
-            log.debug("Finished updating Guilds")
+        async with self.member_counts_lock:
+            # Collect everything first so the transaction is only open for the write itself.
+            schemas = await self.get_guild_schemas()
+            async with self.bot.db as session:
+                await session.guilds.upsert_many(schemas)
+                await session.commit()
+        log.debug(f"Finished updating {len(schemas)} Guilds")
 
     async def create_guild_schema(self, guild: discord.Guild, member_count: Optional[int] = None) -> GuildSchema:
         member_count = member_count or await self.member_count(guild)
@@ -82,12 +137,34 @@ class GuildFeatures(commands.Cog):
                 await session.guilds.upsert(schema)
                 await session.commit()
 
+    async def flush_member_counts(self):
+        async with self.member_counts_lock:
+            deltas = self.member_counts.drain()
+            if not deltas:
+                return
+            try:
+                async with self.bot.db as session:
+                    missing = await session.guilds.apply_member_count_deltas(deltas)
+                    guilds = [g for g in map(self.bot.get_guild, missing) if g is not None]
+                    if guilds:
+                        # The counts of new rows already include the buffered joins
+                        await session.guilds.upsert_many([await self.create_guild_schema(g) for g in guilds])
+                    await session.commit()
+            except (asyncpg.PostgresError, asyncpg.InterfaceError, OSError, discord.HTTPException):
+                log.exception(f"Could not flush member counts for {len(deltas)} guilds. Retrying next flush")
+                self.member_counts.restore(deltas)
+
+    @tasks.loop(seconds=MEMBER_COUNT_FLUSH_INTERVAL, reconnect=True)
+    async def flush_member_counts_task(self):
+        await self.flush_member_counts()
+
     @commands.Cog.listener()
     async def on_member_join(self, member: discord.Member):
-        async with self.bot.db as session:
-            schema = session.guilds.increment_member_count(member.guild.id)
-            if schema is None:
-                schema = await self.create_guild_schema(member.guild)
-                await session.guilds.upsert(schema)
-            await session.commit()
+        # The only join listener. Features register their join handling on the pipeline.
+        self.member_counts.record(member.guild.id, 1)
+        join_pipeline.submit(member)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: discord.Member):
+        self.member_counts.record(member.guild.id, -1)
 
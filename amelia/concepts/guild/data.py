@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Optional
+from typing import Optional, Iterable, Dict, List
 
 import asyncpg
 import discord
@@ -17,29 +17,41 @@ class GuildSchema(BaseModel):
     guild_name: str
 
 
-class GuildDataContext:
+GUILD_COLUMNS = "id, created, updated, joined, member_count, vanity_url, guild_id, guild_name"
 
-    def __init__(self, session: asyncpg.Connection):
-        self.session = session
-
-    async def upsert(self, schema: GuildSchema):
-        q = """
+UPSERT_QUERY = """
       insert into guilds (guild_id, guild_name, joined, member_count, vanity_url)
       values ($1, $2, $3, $4, $5)
 
       on conflict (guild_id)
       do update set guild_id = $1, guild_name = $2, joined = $3, member_count = $4, vanity_url = $5
-      returning id, created, updated;
       """
-        result = await self.session.fetchrow(q,
-            schema.guild_id, schema.guild_name, schema.joined, schema.member_count, schema.vanity_url
-        )
+
+
+class GuildDataContext:
+
+    def __init__(self, session: asyncpg.Connection):
+        self.session = session
+
+    @staticmethod
+    def _upsert_args(schema: GuildSchema):
+        return schema.guild_id, schema.guild_name, schema.joined, schema.member_count, schema.vanity_url
+
+    async def upsert(self, schema: GuildSchema):
+        q = UPSERT_QUERY + "returning id, created, updated;"
+        result = await self.session.fetchrow(q, *self._upsert_args(schema))
         values = schema.model_dump()
         values.update(**(result or {}))
         return GuildSchema(**values)
 
+    async def upsert_many(self, schemas: Iterable[GuildSchema]):
+        """
+        Upserts every guild in a single round trip. Unlike upsert, nothing is returned.
+        """
+        await self.session.executemany(UPSERT_QUERY, [self._upsert_args(s) for s in schemas])
+
     async def fetch_guild(self, guild_id: int) -> Optional[GuildSchema]:
-        q = "select * from guilds where guild_id = $1;"
+        q = f"select {GUILD_COLUMNS} from guilds where guild_id = $1;"
         result = await self.session.fetchrow(q, guild_id)
         if result is None:
             return
@@ -55,18 +67,32 @@ class GuildDataContext:
         await self.upsert(schema)
 
     async def update_member_count(self, guild_id: int, new_member_count: int):
-        q = """update guilds set member_count = $2 where guild_id = $1 returning *; """
+        q = f"update guilds set member_count = $2 where guild_id = $1 returning {GUILD_COLUMNS};"
         o = await self.session.fetchrow(q, guild_id, new_member_count)
         return o if o is None else GuildSchema(**o)
     
     async def increment_member_count(self, guild_id: int) -> Optional[GuildSchema]:
-        q = """
+        q = f"""
             update guilds set member_count = 
                 case 
                     when member_count IS NULL THEN 1
                     else member_count + 1
                 end
             where guild_id = $1 
-            returning *; """
+            returning {GUILD_COLUMNS}; """
         o = await self.session.fetchrow(q, guild_id)
         return o if o is None else GuildSchema(**o)
+
+    async def apply_member_count_deltas(self, deltas: Dict[int, int]) -> List[int]:
+        """
+        Adds each delta to its guild's member count in a single statement. Returns the
+        guild ids that have no row yet.
+        """
+        q = """
+            update guilds g set member_count = greatest(coalesce(g.member_count, 0) + d.delta, 0)
+            from unnest($1::bigint[], $2::int[]) as d(guild_id, delta)
+            where g.guild_id = d.guild_id
+            returning g.guild_id; """
+        rows = await self.session.fetch(q, list(deltas.keys()), list(deltas.values()))
+        updated = {r['guild_id'] for r in rows}
+        return [guild_id for guild_id in deltas if guild_id not in updated]
@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable, List, Optional
+
+import discord
+
+log = logging.getLogger(__name__)
+
+JoinStep = Callable[[discord.Member], Awaitable[None]]
+
+JOIN_QUEUE_SIZE = int(os.environ.get('JOIN_QUEUE_SIZE', 1000))
+JOIN_WORKERS = int(os.environ.get('JOIN_WORKERS', 2))
+JOIN_DRAIN_TIMEOUT = float(os.environ.get('JOIN_DRAIN_TIMEOUT', 10))
+
+
+class MemberJoinPipeline:
+    """
+    Runs every feature's member join handling from one queue.
+
+    Features register steps instead of listening to on_member_join themselves. Joins are
+    queued and handled by ``workers`` tasks, so a join flood is worked through at a pace
+    the REST rate limits allow instead of all at once. Steps run in registration order
+    and a failing step does not stop the others. When the queue is full, joins are dropped.
+
+    Closing stops new joins from being accepted and gives queued ones ``drain_timeout``
+    seconds to finish before the workers are cancelled. ``start`` opens it again.
+    """
+
+    def __init__(
+            self,
+            max_size: int = JOIN_QUEUE_SIZE,
+            workers: int = JOIN_WORKERS,
+            drain_timeout: float = JOIN_DRAIN_TIMEOUT
+    ):
+        self.max_size = max_size
+        self.workers = workers
+        self.drain_timeout = drain_timeout
+        self.closed = False
+        self.steps: List[JoinStep] = []
+        self.dropped = 0
+        self._queue: Optional[asyncio.Queue[discord.Member]] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def register(self, step: JoinStep):
+        if step not in self.steps:
+            self.steps.append(step)
+
+    def unregister(self, step: JoinStep):
+        if step in self.steps:
+            self.steps.remove(step)
+
+    @property
+    def pending(self) -> int:
+        return 0 if self._queue is None else self._queue.qsize()
+
+    def start(self):
+        self.closed = False
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def close(self):
+        self.closed = True
+        if self._queue is not None and self._tasks:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout=self.drain_timeout)
+            except asyncio.TimeoutError:
+                log.warning(f"Dropping {self._queue.qsize()} queued member joins on close")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+
+    def submit(self, member: discord.Member):
+        if self.closed:
+            self.dropped += 1
+            log.warning(f"Member join pipeline is closed. Dropping join for {member.guild.id}/{member.id}")
+            return
+        if self._queue is None:
+            self.start()
+        try:
+            self._queue.put_nowait(member) # type: ignore
+        except asyncio.QueueFull:
+            self.dropped += 1
+            log.warning(f"Member join queue is full. Dropping join for {member.guild.id}/{member.id}")
+
+    async def join(self):
+        """
+        Waits until every queued join has been handled.
+        """
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def _work(self):
+        queue = self._queue
+        assert queue is not None
+        while True:
+            member = await queue.get()
+            try:
+                await self._run(member)
+            finally:
+                queue.task_done()
+
+    async def _run(self, member: discord.Member):
+        for step in list(self.steps):
+            try:
+                await step(member)
+            except Exception:
+                log.exception(f"Member join step {step!r} failed for {member.guild.id}/{member.id}")
+
+
+join_pipeline = MemberJoinPipeline()
@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+from collections import defaultdict
+from typing import Dict
+
+
+class MemberCountBuffer:
+    """
+    Aggregates member joins and leaves per guild in memory, so that they can be written
+    as one batch of deltas instead of a transaction per event.
+    """
+
+    def __init__(self):
+        self._deltas: Dict[int, int] = defaultdict(int)
+
+    def __len__(self) -> int:
+        return len(self._deltas)
+
+    def record(self, guild_id: int, delta: int):
+        self._deltas[guild_id] += delta
+
+    def drain(self) -> Dict[int, int]:
+        """
+        Takes every pending non zero delta out of the buffer.
+        """
+        deltas = {guild_id: delta for guild_id, delta in self._deltas.items() if delta}
+        self._deltas = defaultdict(int)
+        return deltas
+
+    def discard(self, guild_id: int):
+        # The guild's absolute count is being written, which already includes these.
+        self._deltas.pop(guild_id, None)
+
+    def restore(self, deltas: Dict[int, int]):
+        # Puts back deltas from a flush that failed, on top of anything recorded since.
+        for guild_id, delta in deltas.items():
+            self._deltas[guild_id] += delta
@@ -1,17 +1,22 @@
 from __future__ import annotations
 
+import asyncio
 import json
 import logging
+import os
 import pathlib
+import random
+import time
+from contextlib import asynccontextmanager
 from contextvars import ContextVar
-from typing import Callable, List, Dict, Any, Type, TypeVar, Generic, Optional, TypedDict
+from typing import Callable, List, Any, Type, TypeVar, Generic, Optional, TypedDict, Tuple, AsyncIterator
 import asyncpg
 import asyncpg.transaction
 import yoyo
 
+from .notify import NotifyDispatcher
+
 log = logging.getLogger(__name__)
-ctx_connection = ContextVar("ctx_connection")
-ctx_transaction = ContextVar("ctx_transaction") #gfgfdggdggdgfdfgdg
 
 class UnknownEntity(Exception):
     pass
@@ -23,15 +28,33 @@ class PgNotify(TypedDict):
 
 
 class BaseUOW:
-    def __init__(self, connection: asyncpg.Connection[Any] | asyncpg.pool.PoolConnectionProxy[Any]):
+    def __init__(
+            self,
+            connection: asyncpg.Connection[Any] | asyncpg.pool.PoolConnectionProxy[Any],
+            transaction: Optional[asyncpg.transaction.Transaction] = None
+    ):
         self.session = connection
+        self.transaction = transaction
+        self.committed = False
 
     async def commit(self):
-        trans = ctx_transaction.get()
-        await trans.commit()
+        if self.transaction is None:
+            return
+        await self.transaction.commit()
+        self.committed = True
+
+    async def rollback(self):
+        if self.transaction is None or self.committed:
+            return
+        await self.transaction.rollback()
+        # A rolled back unit of work is finished as well
+        self.committed = True
 
 T = TypeVar('T', bound=BaseUOW)
 
+# The units of work opened by `async with db` in the current task, innermost last.
+ctx_sessions: ContextVar[Tuple[BaseUOW, ...]] = ContextVar("ctx_sessions", default=())
+
 class Pg(Generic[T]):
 
     @classmethod
@@ -40,14 +63,61 @@ class Pg(Generic[T]):
 
 
 
-    def __init__(self, dsn: str, uow_cls: Type[T] = type(BaseUOW)):
+    def __init__(
+            self,
+            dsn: str,
+            uow_cls: Type[T] = type(BaseUOW),
+            health_interval: Optional[float] = None,
+            health_timeout: Optional[float] = None,
+            backoff_base: Optional[float] = None,
+            backoff_max: Optional[float] = None,
+            min_size: Optional[int] = None,
+            max_size: Optional[int] = None,
+            max_inactive_connection_lifetime: Optional[float] = None,
+            replica_dsn: Optional[str] = None,
+            statement_cache_size: Optional[int] = None,
+    ):
+        if health_interval is None:
+            health_interval = float(os.environ.get('LISTEN_HEALTH_INTERVAL', 30))
+        if health_timeout is None:
+            health_timeout = float(os.environ.get('LISTEN_HEALTH_TIMEOUT', 5))
+        if backoff_base is None:
+            backoff_base = float(os.environ.get('LISTEN_BACKOFF_BASE', 1))
+        if backoff_max is None:
+            backoff_max = float(os.environ.get('LISTEN_BACKOFF_MAX', 60))
+        if min_size is None:
+            min_size = int(os.environ.get('DB_POOL_MIN_SIZE', 2))
+        if max_size is None:
+            max_size = int(os.environ.get('DB_POOL_MAX_SIZE', 10))
+        if max_inactive_connection_lifetime is None:
+            max_inactive_connection_lifetime = float(os.environ.get('DB_POOL_MAX_INACTIVE_LIFETIME', 300))
+        if statement_cache_size is None:
+            statement_cache_size = int(os.environ.get('DB_STATEMENT_CACHE_SIZE', 100))
+        if replica_dsn is None:
+            replica_dsn = os.environ.get('DB_REPLICA_DSN') or None
         self.pool: Optional[asyncpg.Pool] = None
+        self.replica_pool: Optional[asyncpg.Pool] = None
         self.dsn = dsn
-        self._conn = None
+        self.replica_dsn = replica_dsn
+        self.statement_cache_size = statement_cache_size
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_inactive_connection_lifetime = max_inactive_connection_lifetime
+        self.acquisitions = 0
+        self.acquire_wait_seconds = 0.0
+        self.max_acquire_wait = 0.0
+        self._pool_lock = asyncio.Lock()
         self._polling_conn: Optional[asyncpg.Connection] = None
-        self.table_listeners: Dict[str, List[Callable]] = {}
-        self.global_listeners: List[Callable] = []
+        self.dispatcher = NotifyDispatcher()
         self.uow_cls: Type[T] = uow_cls
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.reconnects = 0
+        self.connected_since: Optional[float] = None
+        self._connection_lost = asyncio.Event()
+        self._supervisor: Optional[asyncio.Task] = None
 
     def migrate(self):
         migrations_folder = str(pathlib.Path(__file__).parents[1] / "migrations")
@@ -58,6 +128,63 @@ class Pg(Generic[T]):
         with backend.lock():
             backend.apply_migrations(backend.to_apply(migrations))
 
+    async def _create_pool(self, dsn: str) -> asyncpg.Pool:
+        return await asyncpg.create_pool(
+            dsn,
+            min_size=self.min_size,
+            max_size=self.max_size,
+            max_inactive_connection_lifetime=self.max_inactive_connection_lifetime,
+            # Data contexts use fixed query text, so each statement is prepared once per connection.
+            statement_cache_size=self.statement_cache_size
+        )
+
+    async def create_pool(self) -> asyncpg.Pool:
+        """
+        Creates the connection pools. Called once at startup, and lazily by the first
+        unit of work otherwise.
+        """
+        async with self._pool_lock:
+            if self.pool is None:
+                self.pool = await self._create_pool(self.dsn)
+            if self.replica_dsn is not None and self.replica_pool is None:
+                self.replica_pool = await self._create_pool(self.replica_dsn)
+        return self.pool
+
+    async def close(self):
+        for pool in (self.pool, self.replica_pool):
+            if pool is not None:
+                await pool.close()
+        self.pool = None
+        self.replica_pool = None
+
+    async def _acquire(self, replica: bool = False) -> Tuple[asyncpg.Pool, asyncpg.pool.PoolConnectionProxy]:
+        pool = self.pool or await self.create_pool()
+        if replica and self.replica_pool is not None:
+            pool = self.replica_pool
+        started = time.perf_counter()
+        conn = await pool.acquire()
+        waited = time.perf_counter() - started
+        self.acquisitions += 1
+        self.acquire_wait_seconds += waited
+        self.max_acquire_wait = max(self.max_acquire_wait, waited)
+        return pool, conn
+
+    @asynccontextmanager
+    async def read(self, replica: bool = False) -> AsyncIterator[T]:
+        """
+        A unit of work for pure lookups. There is no transaction, so each query runs on its
+        own and nothing can be committed.
+
+        With ``replica`` the lookups go to the read replica when one is configured. Replicas
+        may lag behind, so results which are cached and invalidated through notifications
+        should be read from the primary.
+        """
+        pool, conn = await self._acquire(replica)
+        try:
+            yield self.uow_cls(conn) #type: ignore
+        finally:
+            await pool.release(conn)
+
     async def _init_connection(self) -> asyncpg.Connection[asyncpg.Record]:
         if self._polling_conn is None or self._polling_conn.is_closed():
             log.debug(f"Connecting to {self.dsn}")
@@ -65,60 +192,163 @@ class Pg(Generic[T]):
         return self._polling_conn
 
 
-    async def start_listening(self):
+    async def _listen(self):
         self._polling_conn = await self._init_connection()
-        if self._polling_conn is not None:
-            await self._polling_conn.add_listener('events', self._notify)
-            log.debug("Pg Service now listening for 'events'")
+        self._polling_conn.add_termination_listener(self._on_connection_lost)
+        await self._polling_conn.add_listener('events', self._notify)
+        self.connected_since = time.monotonic()
+        log.debug("Pg Service now listening for 'events'")
+
+    def _on_connection_lost(self, conn: asyncpg.Connection):
+        if conn is not self._polling_conn:
+            return
+        self.connected_since = None
+        self._connection_lost.set()
+
+    async def _healthy(self) -> bool:
+        conn = self._polling_conn
+        if conn is None or conn.is_closed():
+            return False
+        try:
+            await asyncio.wait_for(conn.fetchval('select 1'), timeout=self.health_timeout)
+            return True
+        except (asyncio.TimeoutError, asyncpg.PostgresError, OSError, asyncpg.InterfaceError):
+            return False
+
+    async def _reconnect(self):
+        attempt = 0
+        while True:
+            old = self._polling_conn
+            self._polling_conn = None
+            if old is not None and not old.is_closed():
+                old.remove_termination_listener(self._on_connection_lost)
+                old.terminate()
+            try:
+                await self._listen()
+            except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError, asyncio.TimeoutError) as e:
+                delay = min(self.backoff_max, self.backoff_base * 2 ** attempt) * random.uniform(0.5, 1)
+                attempt += 1
+                log.warning(f"LISTEN reconnect attempt {attempt} failed ({e!r}). Retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            self.reconnects += 1
+            log.info(f"LISTEN connection re-established after {attempt + 1} attempt(s). Flushing caches")
+            # Anything that changed while we were away was never notified.
+            self.dispatcher.flush()
+            return
+
+    async def _supervise(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._connection_lost.wait(), timeout=self.health_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._connection_lost.clear()
+            if await self._healthy():
+                continue
+            log.warning("LISTEN connection lost. Reconnecting")
+            self.connected_since = None
+            await self._reconnect()
+
+    async def start_listening(self):
+        """
+        Starts listening for 'events' and supervises the connection from then on. It is
+        health checked every ``health_interval`` seconds and reconnected with exponential
+        backoff when lost, after which the flush listeners run.
+        """
+        await self._listen()
+        if self._supervisor is None or self._supervisor.done():
+            self._connection_lost = asyncio.Event()
+            self._supervisor = asyncio.create_task(self._supervise())
 
     async def stop_listening(self):
-        if self._conn is not None and not self._conn.is_closed():
-            await self._conn.remove_listener('events', self._notify)
-            await self._conn.close()
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+            await asyncio.gather(self._supervisor, return_exceptions=True)
+            self._supervisor = None
+        conn = self._polling_conn
+        if conn is not None and not conn.is_closed():
+            conn.remove_termination_listener(self._on_connection_lost)
+            await conn.remove_listener('events', self._notify)
+            await conn.close()
+        self._polling_conn = None
+        self.connected_since = None
+        await self.dispatcher.close()
+
+    def metrics(self) -> List[str]:
+        uptime = 0.0 if self.connected_since is None else time.monotonic() - self.connected_since
+        dispatcher = self.dispatcher
+        return [
+            "# TYPE amelia_listener_connected gauge",
+            f"amelia_listener_connected {int(self.connected_since is not None)}",
+            "# TYPE amelia_listener_uptime_seconds gauge",
+            f"amelia_listener_uptime_seconds {uptime:.0f}",
+            "# TYPE amelia_listener_reconnects_total counter",
+            f"amelia_listener_reconnects_total {self.reconnects}",
+            "# TYPE amelia_notify_received_total counter",
+            f"amelia_notify_received_total {dispatcher.received}",
+            "# TYPE amelia_notify_coalesced_total counter",
+            f"amelia_notify_coalesced_total {dispatcher.coalesced}",
+            "# TYPE amelia_notify_failures_total counter",
+            f"amelia_notify_failures_total {dispatcher.failures}",
+            "# TYPE amelia_notify_overflows_total counter",
+            f"amelia_notify_overflows_total {dispatcher.overflows}",
+            "# TYPE amelia_notify_pending gauge",
+            f"amelia_notify_pending {dispatcher.pending}",
+            "# TYPE amelia_db_pool_size gauge",
+            f"amelia_db_pool_size {self.pool.get_size() if self.pool is not None else 0}",
+            "# TYPE amelia_db_pool_idle gauge",
+            f"amelia_db_pool_idle {self.pool.get_idle_size() if self.pool is not None else 0}",
+            "# TYPE amelia_db_pool_acquisitions_total counter",
+            f"amelia_db_pool_acquisitions_total {self.acquisitions}",
+            "# TYPE amelia_db_pool_wait_seconds_total counter",
+            f"amelia_db_pool_wait_seconds_total {self.acquire_wait_seconds:.6f}",
+            "# TYPE amelia_db_pool_max_wait_seconds gauge",
+            f"amelia_db_pool_max_wait_seconds {self.max_acquire_wait:.6f}",
+        ]
 
     def register_listener(self, callback: Callable, tables: Optional[List[str]] = None):
-        if tables is None:
-            self.global_listeners.append(callback)
-            return
-        for t in tables:
-            if t not in self.table_listeners.keys():
-                self.table_listeners[t] = []
-            self.table_listeners[t].append(callback)
+        self.dispatcher.add_listener(callback, tables)
 
-    async def _notify(
+    def register_flush_listener(self, callback: Callable):
+        """
+        Registers a callback that drops everything a cache holds. Called whenever
+        notifications may have been lost.
+        """
+        self.dispatcher.add_flush_listener(callback)
+
+    def _notify(
             self, 
             connection: asyncpg.Connection[Any] | asyncpg.pool.PoolConnectionProxy[Any], 
             pid: int, 
             channel: str, 
             payload: object):
-        
+        # Runs inside the connection's protocol, only queue the work here.
         log.debug(f"PG Notify: {payload}")
         data: PgNotify = json.loads(str(payload))
-        args = (data['table'], data['action'], data['id'])
-        for callback in self.table_listeners.get(args[0], []):
-            await callback(*args)
-        for callback in self.global_listeners:
-            await callback(*args)
+        self.dispatcher.put(data['table'], data['action'], data['id'])
 
     async def __aenter__(self) -> T:
-        if self.pool is None:
-            self.pool = await asyncpg.create_pool(self.dsn)
-        if self.pool is not None:
-            self._conn = await self.pool.acquire()
-            if self._conn is None:
-                raise asyncpg.ConnectionFailureError
-            self._trans = self._conn.transaction()
-            await self._trans.start()
-            ctx_connection.set(self._conn)
-            ctx_transaction.set(self._trans)
-        return self.uow_cls(self._conn) #type: ignore
+        # Every `async with` gets its own connection and transaction. They are tracked per
+        # task, so concurrent and nested blocks never see each other's state.
+        pool, conn = await self._acquire()
+        try:
+            trans = conn.transaction()
+            await trans.start()
+        except BaseException:
+            await pool.release(conn)
+            raise
+        uow = self.uow_cls(conn, trans) #type: ignore
+        ctx_sessions.set(ctx_sessions.get() + (uow,))
+        return uow
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        conn = ctx_connection.get()
-        trans = ctx_transaction.get()
-        if exc_type:
-            await trans.rollback()
+        *outer, uow = ctx_sessions.get()
+        ctx_sessions.set(tuple(outer))
         try:
-            await conn.close()
-        except Exception:
-            pass
+            # Nothing is committed implicitly
+            await uow.rollback()
+        except (asyncpg.PostgresError, asyncpg.InterfaceError, OSError):
+            log.exception("Could not roll back unit of work")
+        finally:
+            await self.pool.release(uow.session) # type: ignore
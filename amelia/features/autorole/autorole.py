@@ -5,7 +5,10 @@ from typing import TYPE_CHECKING, Optional
 
 import discord
 from discord.ext import commands
+
+from amelia.concepts.guild.joins import join_pipeline
 from .config import AutoRoleConfig
+from .data import AutoRoleDataContext
 from .services import convert_schemas_to_role_objects
 
 if TYPE_CHECKING:
@@ -20,21 +23,33 @@ class AutoRole(commands.Cog):
         self.bot = bot
         self.config_command: Optional[Group] = None
 
-
-
-    @commands.Cog.listener()
-    async def on_member_join(self, member: discord.Member):
-        async with self.bot.db as session:
-            schemas = await session.auto_roles.guild_auto_roles(member.guild.id)
-            roles = convert_schemas_to_role_objects(member.guild, schemas)
-        for role in roles:
-            try:
-                await member.add_roles(role)
-            except discord.Forbidden:
-                log.warning(
-                    f"No AutoRole Manage Role Permissions or role in higher hierarchy: "
-                    f"{member.guild.name}"
-                )
+    async def assign_auto_roles(self, member: discord.Member):
+        """
+        Member join step. Auto-roles usually come straight from the cache, so a join
+        needs no connection, and every assignable role is added in a single request.
+        """
+        schemas = AutoRoleDataContext.guild_auto_roles.cached(member.guild.id)
+        if schemas is None:
+            async with self.bot.db.read() as session:
+                schemas = await session.auto_roles.guild_auto_roles(member.guild.id)
+        roles = [r for r in convert_schemas_to_role_objects(member.guild, schemas) if r not in member.roles]
+        # One role the bot cannot manage would make the whole request fail
+        unassignable = [r for r in roles if not r.is_assignable()]
+        if unassignable:
+            log.warning(
+                f"No AutoRole Manage Role Permissions or role in higher hierarchy: "
+                f"{member.guild.name} - {', '.join(r.name for r in unassignable)}"
+            )
+        roles = [r for r in roles if r not in unassignable]
+        if not roles:
+            return
+        try:
+            await member.add_roles(*roles, reason="AutoRole")
+        except discord.Forbidden:
+            log.warning(
+                f"No AutoRole Manage Role Permissions or role in higher hierarchy: "
+                f"{member.guild.name}"
+            )
 
     @commands.Cog.listener()
     async def on_guild_role_delete(self, role: discord.Role):
@@ -45,7 +60,9 @@ class AutoRole(commands.Cog):
     async def cog_load(self) -> None:
         self.config_command = AutoRoleConfig(self.bot)
         self.bot.config_group.add_command(self.config_command)
-        
+        join_pipeline.register(self.assign_auto_roles)
+
     async def cog_unload(self) -> None:
+        join_pipeline.unregister(self.assign_auto_roles)
         if self.config_command is not None:
             self.bot.config_group.remove_command(self.config_command.name)
@@ -1,31 +1,44 @@
 import logging
+import os
 from typing import Optional, List, TYPE_CHECKING
 from amelia.instances import db
-from .schema import AutoRoleSchema
+from .schema import AutoRoleSchema, AutoRoleRecord, AUTOROLE_COLUMNS
 from amelia.cache import FunctionOperationsCache
 import asyncpg
 if TYPE_CHECKING:
     from asyncpg import Record
 log = logging.getLogger(__name__)
 
-cache = FunctionOperationsCache[AutoRoleSchema]('id')
+cache = FunctionOperationsCache[AutoRoleRecord](
+    'id',
+    max_size=1024,
+    ttl=float(os.environ.get('AUTOROLE_CACHE_TTL', 600)),
+    name='autorole'
+)
 
 
 async def database_change_notify(_: str, action: str, _id: int):
     if action == "DELETE":
-        cache.invalidate(_id)
         cache.invalidate_function_cache_object(_id)
         log.debug(f"auto role cache item invalidated for {_id}")
     if action == "UPDATE":
-        async with db as session:
+        async with db.read() as session:
             o = await session.auto_roles.get_auto_role(_id)
         if o is  None:
             return
-        cache.put(_id, o)
         cache.update_function_cache_object(o)
         log.debug(f"auto role cache item updated for {_id}")
+    if action == "INSERT":
+        # The new role belongs to a guild list that may already be cached.
+        cache.clear()
 
 db.register_listener(database_change_notify, tables=['autorole'])
+db.register_flush_listener(cache.clear)
+
+
+ALL_AUTO_ROLES_QUERY = f"select {AUTOROLE_COLUMNS} from autorole order by id;"
+GUILD_AUTO_ROLES_QUERY = f"select {AUTOROLE_COLUMNS} from autorole where guild_id = $1;"
+GET_AUTO_ROLE_QUERY = f"select {AUTOROLE_COLUMNS} from autorole where id = $1;"
 
 
 class AutoRoleDataContext:
@@ -34,7 +47,7 @@ class AutoRoleDataContext:
         self.session = session
 
     async def add_auto_role(self, guild_id: int, role_id: int) -> AutoRoleSchema:
-        q = "insert into autorole (guild_id, role_id) values ($1, $2) returning *"
+        q = f"insert into autorole (guild_id, role_id) values ($1, $2) returning {AUTOROLE_COLUMNS}"
         result: Record = await self.session.fetchrow(q, guild_id, role_id)  # type: ignore
         return AutoRoleSchema(**result)
         
@@ -43,22 +56,20 @@ class AutoRoleDataContext:
         await self.session.execute(q, role_id)
 
 
-    async def all_auto_roles(self) -> List[AutoRoleSchema]:
-        q = "select * from autorole;"
-        results = await self.session.fetch(q)
-        return [AutoRoleSchema(**r) for r in results]
+    async def all_auto_roles(self) -> List[AutoRoleRecord]:
+        results = await self.session.fetch(ALL_AUTO_ROLES_QUERY)
+        return [AutoRoleRecord.from_row(r) for r in results]
 
 
-    async def guild_auto_roles(self, guild_id: int) -> List[AutoRoleSchema]:
-        q = "select * from autorole where guild_id = $1;"
-        results = await self.session.fetch(q, guild_id)
-        return [AutoRoleSchema(**r) for r in results]
+    @cache.function(class_level=True)
+    async def guild_auto_roles(self, guild_id: int) -> List[AutoRoleRecord]:
+        results = await self.session.fetch(GUILD_AUTO_ROLES_QUERY, guild_id)
+        return [AutoRoleRecord.from_row(r) for r in results]
 
 
-    async def get_auto_role(self, _id: int) -> Optional[AutoRoleSchema]:
-        q = "select * from autorole where id = $1;"
-        result = await self.session.fetchrow(q, _id)
+    async def get_auto_role(self, _id: int) -> Optional[AutoRoleRecord]:
+        result = await self.session.fetchrow(GET_AUTO_ROLE_QUERY, _id)
         if result is None:
             return None    
-        return AutoRoleSchema(**result)
+        return AutoRoleRecord.from_row(result)
     
\ No newline at end of file
@@ -1,5 +1,8 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Optional
+from typing import Optional, Mapping, Any
 
 from pydantic import BaseModel
 
@@ -10,3 +13,22 @@ class AutoRoleSchema(BaseModel):
     updated_at: Optional[datetime] = None
     guild_id: int
     role_id: int
+
+
+@dataclass(slots=True)
+class AutoRoleRecord:
+    """
+    An autorole row as read from the database. Rows are trusted, so there is no validation.
+    """
+    id: int
+    guild_id: int
+    role_id: int
+    created_at: datetime
+    updated_at: datetime
+
+    @classmethod
+    def from_row(cls, row: Mapping[str, Any]) -> AutoRoleRecord:
+        return cls(row['id'], row['guild_id'], row['role_id'], row['created_at'], row['updated_at'])
+
+
+AUTOROLE_COLUMNS = "id, guild_id, role_id, created_at, updated_at"
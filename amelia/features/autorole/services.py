@@ -1,7 +1,7 @@
 import discord
-from .data import AutoRoleSchema
+from .schema import AutoRoleRecord
 
-def convert_schemas_to_role_objects(guild: discord.Guild, schemas: list[AutoRoleSchema]) -> list[discord.Role]:
+def convert_schemas_to_role_objects(guild: discord.Guild, schemas: list[AutoRoleRecord]) -> list[discord.Role]:
     container: list[discord.Role] = []
     for schema in schemas:
         role = discord.utils.get(guild.roles, id=schema.role_id)
@@ -28,15 +28,15 @@ class ConfirmSyncModal(ui.Modal, title="Sync all auto-roles to all users"):
         if guild is None:
             await itx.response.send_message("Something went wrong. Could not locate guild from cache", ephemeral=True)
             return
-        async with self.cog.bot.db as session:
+        async with self.cog.bot.db.read() as session:
             log.debug(f"calling guild_auto_roles({itx.guild_id})")
             schemas = await session.auto_roles.guild_auto_roles(guild.id)
             auto_roles = convert_schemas_to_role_objects(guild, schemas)
         try:
             for member in guild.members:
-                for role in auto_roles:
-                    if role not in member.roles:
-                        await member.add_roles(role)
+                missing = [role for role in auto_roles if role not in member.roles]
+                if missing:
+                    await member.add_roles(*missing, reason="AutoRole sync")
         except discord.Forbidden:
             await itx.response.send_message(
                 "Autorole sync has failed. The bot does not have permissions to add roles", 
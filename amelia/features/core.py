@@ -1,16 +1,22 @@
 import logging
+import os
+from io import BytesIO
 
 import discord
 from discord import app_commands, Interaction
 from discord.ext.commands import Cog
-from discord.ext import commands
+from discord.ext import commands, tasks
 
 from amelia import common
 from amelia.bot import AmeliaBot
+from amelia.cache import sweep_caches
+from amelia.metrics import registry
 from typing import Optional, Literal
 
 log = logging.getLogger(__name__)
 
+CACHE_SWEEP_INTERVAL = float(os.environ.get('CACHE_SWEEP_INTERVAL', 300))
+
 custom_extensions = (
     'amelia.concepts.guild',
     'amelia.features.forum_channels',
@@ -36,6 +42,19 @@ class Core(Cog):
     def __init__(self, bot: AmeliaBot):
         self.bot = bot
 
+    async def cog_load(self) -> None:
+        self.sweep_caches_task.start()
+
+    async def cog_unload(self) -> None:
+        self.sweep_caches_task.cancel()
+
+    @tasks.loop(seconds=CACHE_SWEEP_INTERVAL)
+    async def sweep_caches_task(self):
+        # Caches only sweep themselves when used, this covers the idle ones.
+        removed = sweep_caches()
+        if removed:
+            log.debug(f"Swept {removed} expired cache entries")
+
     @app_commands.command(name='reproduce')
     async def reproduce(self, interaction: discord.Interaction, channel: discord.ForumChannel):
         await interaction.response.send_message(channel.name)
@@ -117,6 +136,25 @@ class Core(Cog):
         embed = discord.Embed(title="Guiids", description=description)
         await itx.response.send_message(embed=embed, ephemeral=True)
 
+    @app_commands.command(name='cache-stats', description='Show cache hit rates and sizes')
+    async def cache_stats_cmd(self, itx: discord.Interaction):
+        if not (await self.bot.is_owner(itx.user)):
+            await itx.response.send_message("You do not have access to this command",ephemeral=True)
+            return
+        embed = discord.Embed(title="Cache Stats")
+        for name, stats in sorted(registry.caches.items()):
+            size = f"{stats.size} ({stats.weight / 1024:.0f} KiB)" if stats.weight else str(stats.size)
+            value = (
+                f"Hits: {stats.hits} / Misses: {stats.misses} ({stats.hit_ratio:.1%})\n"
+                f"Size: {size}\n"
+                f"Evictions: {stats.evictions} / Expirations: {stats.expirations} / "
+                f"Invalidations: {stats.invalidations}\n"
+                f"Mean Load: {stats.mean_load_seconds * 1000:.1f} ms"
+            )
+            embed.add_field(name=name, value=value, inline=False)
+        dump = discord.File(BytesIO(registry.prometheus().encode()), filename='metrics.prom')
+        await itx.response.send_message(embed=embed, file=dump, ephemeral=True)
+
 async def setup(bot: AmeliaBot):
     log.debug("in setup")
     core = Core(bot)
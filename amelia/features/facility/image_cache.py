@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import asyncio
+import collections
+import hashlib
+import logging
+import os
+import pathlib
+import shutil
+import uuid
+from io import BytesIO
+from typing import List, Optional, OrderedDict, Tuple
+
+import aiofiles
+
+from amelia.metrics import CacheStats, registry
+from amelia.singleflight import SingleFlight
+
+log = logging.getLogger(__name__)
+
+CACHE_PATH = pathlib.Path(os.environ.get(
+    'PLATE_CACHE_DIR',
+    pathlib.Path(__file__).parents[3] / 'cache' / 'plates'
+))
+CACHE_MAX_BYTES = int(os.environ.get('PLATE_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
+
+class PlateImageCache:
+    """
+    A size bounded, content addressed disk cache for rendered plate images.
+
+    Images live under ``<root>/<tpp_cycle>/<sha256>.png`` where the hash is taken over the
+    plate's pdf name and render dpi. Plates only change when the 28 day TPP cycle does, so
+    seeing a newer cycle drops every older cycle at once. Within the cache, the least recently
+    used files are evicted once the total size exceeds ``max_bytes``. All disk work runs
+    in worker threads (reads through aiofiles) so it never blocks the event loop.
+    """
+
+    def __init__(
+            self,
+            root: pathlib.Path = CACHE_PATH,
+            max_bytes: int = CACHE_MAX_BYTES,
+            name: Optional[str] = None
+    ):
+        self.root = pathlib.Path(root)
+        self.max_bytes = max_bytes
+        self.current_cycle: Optional[int] = None
+        self.total_bytes = 0
+        self._index: OrderedDict[pathlib.Path, int] = collections.OrderedDict()
+        self._loaded = False
+        self._flights = SingleFlight()
+        self.stats = CacheStats(size_of=lambda: len(self._index), weight_of=lambda: self.total_bytes)
+        if name is not None:
+            registry.register_cache(name, self.stats)
+
+    @staticmethod
+    def digest(pdf_name: str, dpi: int) -> str:
+        return hashlib.sha256(f"{pdf_name}:{dpi}".encode()).hexdigest()
+
+    def path_for(self, tpp_cycle: int, pdf_name: str, dpi: int) -> pathlib.Path:
+        return self.root / str(tpp_cycle) / f"{self.digest(pdf_name, dpi)}.png"
+
+    def _scan(self) -> Tuple[Optional[int], List[Tuple[float, pathlib.Path, int]]]:
+        # Runs in a worker thread. Only the newest cycle is worth indexing.
+        self.root.mkdir(parents=True, exist_ok=True)
+        cycles = [int(p.name) for p in self.root.iterdir() if p.is_dir() and p.name.isdigit()]
+        if not cycles:
+            return None, []
+        cycle = max(cycles)
+        files = []
+        for path in (self.root / str(cycle)).glob('*.png'):
+            stat = path.stat()
+            files.append((stat.st_mtime, path, stat.st_size))
+        return cycle, sorted(files)
+
+    async def _ensure_loaded(self):
+        if not self._loaded:
+            await self._flights.do('load', self._load)
+
+    async def _load(self):
+        # Rebuild the LRU order from disk using access times from previous runs.
+        cycle, files = await asyncio.to_thread(self._scan)
+        for _, path, size in files:
+            self._index[path] = size
+            self.total_bytes += size
+        self._loaded = True
+        if cycle is not None:
+            await self._use_cycle(cycle)
+
+    def _drop_cycles_before(self, tpp_cycle: int):
+        # Runs in a worker thread.
+        for path in self.root.iterdir():
+            if path.is_dir() and path.name.isdigit() and int(path.name) < tpp_cycle:
+                log.info(f"Dropping plate images for TPP cycle {path.name}")
+                shutil.rmtree(path, ignore_errors=True)
+
+    async def _use_cycle(self, tpp_cycle: int):
+        if self.current_cycle is not None and tpp_cycle <= self.current_cycle:
+            return
+        self.current_cycle = tpp_cycle
+        for cached in [p for p in self._index if int(p.parent.name) < tpp_cycle]:
+            self.total_bytes -= self._index.pop(cached)
+            self.stats.expirations += 1
+        await asyncio.to_thread(self._drop_cycles_before, tpp_cycle)
+
+    @staticmethod
+    def _unlink(paths: List[pathlib.Path]):
+        # Runs in a worker thread.
+        for path in paths:
+            path.unlink(missing_ok=True)
+
+    @staticmethod
+    def _touch(path: pathlib.Path):
+        # Runs in a worker thread. Access times carry the LRU order over to the next run.
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _write(path: pathlib.Path, data: bytes):
+        # Runs in a worker thread. Concurrent renders of the same plate each write their own
+        # temp file, the last rename wins.
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.stem}.{uuid.uuid4().hex}.tmp")
+        try:
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+
+    async def _evict(self):
+        evicted = []
+        while self.total_bytes > self.max_bytes and self._index:
+            path, size = self._index.popitem(last=False)
+            self.total_bytes -= size
+            self.stats.evictions += 1
+            evicted.append(path)
+        if evicted:
+            await asyncio.to_thread(self._unlink, evicted)
+
+    async def get(self, tpp_cycle: int, pdf_name: str, dpi: int) -> Optional[BytesIO]:
+        await self._ensure_loaded()
+        path = self.path_for(tpp_cycle, pdf_name, dpi)
+        if path not in self._index:
+            self.stats.misses += 1
+            return None
+        try:
+            async with aiofiles.open(path, mode='rb') as f:
+                data = await f.read()
+        except FileNotFoundError:
+            self.total_bytes -= self._index.pop(path)
+            self.stats.misses += 1
+            return None
+        self.stats.hits += 1
+        self._index.move_to_end(path)
+        await asyncio.to_thread(self._touch, path)
+        return BytesIO(data)
+
+    async def put(self, tpp_cycle: int, pdf_name: str, dpi: int, image: BytesIO):
+        await self._ensure_loaded()
+        if self.current_cycle is not None and tpp_cycle < self.current_cycle:
+            # A straggler from an old cycle. Not worth keeping.
+            return
+        await self._use_cycle(tpp_cycle)
+        path = self.path_for(tpp_cycle, pdf_name, dpi)
+        data = image.getvalue()
+        await asyncio.to_thread(self._write, path, data)
+        self.total_bytes -= self._index.pop(path, 0)
+        self._index[path] = len(data)
+        self.total_bytes += len(data)
+        await self._evict()
@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import logging
+from collections import defaultdict
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from discord import app_commands
+
+from amelia.singleflight import SingleFlight
+
+if TYPE_CHECKING:
+    from amelia.tfl import TFLService, FAAPlate
+
+log = logging.getLogger(__name__)
+
+
+class PlateIndex:
+    """
+    An in-memory index of ICAO -> plate choices, built from every plate in the current TPP cycle.
+
+    Plate autocomplete is answered purely from this index so that typing never waits on the
+    TFL API. It is shared by everyone, and rebuilt in the background by the owning cog.
+    """
+
+    def __init__(self, tfl: TFLService):
+        self.tfl = tfl
+        self.tpp_cycle: Optional[int] = None
+        self._built = False
+        self._choices: Dict[str, List[app_commands.Choice[str]]] = {}
+        self._icaos: List[str] = []
+        self._flights = SingleFlight()
+
+    @property
+    def ready(self) -> bool:
+        return self._built
+
+    @property
+    def icaos(self) -> List[str]:
+        return self._icaos
+
+    async def refresh(self):
+        await self._flights.do('refresh', self._build)
+
+    async def _build(self):
+        plates: List[FAAPlate] = await self.tfl.plates.all() # type: ignore
+        index: Dict[str, List[app_commands.Choice[str]]] = defaultdict(list)
+        icaos: Dict[str, str] = {}
+        for plate in plates:
+            key = plate.icao.upper()
+            icaos.setdefault(key, plate.icao)
+            index[key].append(app_commands.Choice(name=plate.name, value=plate.name))
+        cycle = max((p.tpp_cycle for p in plates), default=None)
+        if cycle != self.tpp_cycle:
+            log.info(f"Plate index built for TPP cycle {cycle}: {len(index)} airports, {len(plates)} plates")
+        self._choices = dict(index)
+        self._icaos = list(icaos.values())
+        self.tpp_cycle = cycle
+        self._built = True
+
+    async def choices(self, icao: str) -> List[app_commands.Choice[str]]:
+        if not self.ready:
+            await self.refresh()
+        return self._choices.get(icao.upper(), [])
@@ -1,37 +1,65 @@
+import asyncio
+import contextlib
+import os
+import pathlib
 import re
-from typing import Dict, Any, Optional, List
+import tempfile
+from typing import Dict, Any, Optional, List, AsyncIterator, Tuple
 
 import discord
 from discord import app_commands, Interaction
-from discord.ext import commands
+from discord.ext import commands, tasks
 
-from amelia.auto_choices import DependentFuzzyChoicesCache, AutoCompleteItem, FuzzyChoicesCache
+from amelia.auto_choices import FuzzyChoicesCache, fuzzy_choices
 from amelia.bot import AmeliaBot
 import logging
 
+from .index import PlateIndex
 from .services import plate_to_image_bytes, all_plates_embed
 from io import BytesIO
-from amelia.tfl import TFLService, NoChartSupplementError
+from amelia.tfl import NoChartSupplementError
+from amelia.render import RenderService, RenderQueueFullError, RenderTimeoutError
 log = logging.getLogger(__name__)
 RE_COMMON_TERMS = re.compile(r"\s(runway|rwy|or)\s")
 from zipfile import ZipFile
-from pdf2image import convert_from_bytes
 from .ui import ChartSupplementView
 
+CHART_SUPPLEMENT_DPI = int(os.environ.get('CHART_SUPPLEMENT_DPI', 150))
+
+
+async def send_render_error(itx: Interaction, title: str):
+    embed = discord.Embed(title=title, description="Amelia is busy rendering charts. Please try again shortly.")
+    if itx.response.is_done():
+        await itx.followup.send(embed=embed, ephemeral=True)
+    else:
+        await itx.response.send_message(embed=embed, ephemeral=True)
+
 class PlatesCog(commands.Cog):
 
     def __init__(self, bot: AmeliaBot):
         self.bot = bot
+        self.plate_index = PlateIndex(bot.tfl)
         self.icao_cache = FuzzyChoicesCache(
             fetch_method=self._fetch_plate_icaos,
-            threshold=7
-        )
-        self.plate_name_cache = DependentFuzzyChoicesCache(
-            fetch_method=self._fetch_plates,
-            sanitizer=sanitize_plate_name,
-            threshold=7
+            threshold=7,
+            name='plate_icaos'
         )
 
+    async def cog_load(self) -> None:
+        self.refresh_plate_index_task.start()
+
+    async def cog_unload(self) -> None:
+        self.refresh_plate_index_task.cancel()
+
+    @tasks.loop(hours=6, reconnect=True)
+    async def refresh_plate_index_task(self):
+        # Errors would stop the loop for good. Keep serving the last good index instead.
+        try:
+            await self.plate_index.refresh()
+            await self.icao_cache.refresh()
+        except Exception:
+            log.exception("Plate index refresh failed. Keeping the last index")
+
 
     @staticmethod
     def get_command_argument(options: List[Dict[str, Any]], name: str) -> Optional[Dict[str, Any]]:
@@ -43,8 +71,8 @@ class PlatesCog(commands.Cog):
         try:
             icao_value = itx.namespace.icao
             icao_value = str(icao_value) if icao_value is not None else ''
-            choices = await self.plate_name_cache.retrieve(itx.user.id, icao_value, current)
-            return choices or []
+            choices = await self.plate_index.choices(icao_value)
+            return fuzzy_choices(current, choices, threshold=7)
 
         except AttributeError:
             log.error("Could not retrieve current icao text for FAA Plate autocomplete")
@@ -56,18 +84,10 @@ class PlatesCog(commands.Cog):
         choices = await self.icao_cache.retrieve(current)
         return choices or []
 
-    async def _fetch_plates(self, icao: str) -> AutoCompleteItem:
-        tfl = TFLService()
-        airport = await tfl.fetch_airport(icao)
-        choices = [app_commands.Choice(**{'name': p.name, 'value': p.name}) for p in airport.plates]
-        return AutoCompleteItem(
-            param_value=icao.lower(),
-            choices_cache=choices
-        )
     async def _fetch_plate_icaos(self) -> list[str]:
-        tfl = TFLService()
-        icaos = await tfl.plates.all(icao_only=True)
-        return icaos #type: ignore  bad design from tfl
+        if not self.plate_index.ready:
+            await self.plate_index.refresh()
+        return self.plate_index.icaos
 
     @app_commands.command(name='plates')
     @app_commands.autocomplete(plate_name=_plate_name_autocomplete)
@@ -87,7 +107,7 @@ class PlatesCog(commands.Cog):
         await itx.response.defer()
         plates = await self.bot.tfl.plates.by_icao(icao, name=plate_name)
         plate = plates[0]
-        image_bytes = await plate_to_image_bytes(plate)
+        image_bytes = await plate_to_image_bytes(plate, self.bot.renderer)
         fn = f"{icao.upper()}_{plate_name}.png"
         discord_file = discord.File(image_bytes, filename=fn.replace(' ', '_'))
         await itx.followup.send(f"Full Plate: {plate.plate_url}", file=discord_file)
@@ -101,6 +121,8 @@ class PlatesCog(commands.Cog):
                 description="Could not find that plate. This function only works with U.S. based plates"
                 )
             await itx.response.send_message(embed=embed, ephemeral=True)
+        elif isinstance(original_error, (RenderQueueFullError, RenderTimeoutError)):
+            await send_render_error(itx, "Plate Unavailable")
         else:
             await itx.response.send_message("Unable to retrieve plate.", ephemeral=True)
             raise error
@@ -120,20 +142,19 @@ class ChartSupplementCOG(commands.Cog):
     @app_commands.command(name='chart-supplement')
     @app_commands.describe(icao="Airport ICAO")
     async def chart_supplment(self, itx: Interaction, icao: str):
-
-        tfl = TFLService()
         icao = icao.lower()
 
-        response = await tfl.fetch_chart_supplement(icao)
+        response = await self.bot.tfl.fetch_chart_supplement(icao)
         if not response:
-            response = await tfl.fetch_chart_supplement(icao[1::])
+            response = await self.bot.tfl.fetch_chart_supplement(icao[1::])
         if not response:
             raise NoChartSupplementError
         await itx.response.defer()
-        image_objs = zip_pdfs_to_image(response)
-        discord_files = [discord.File(img, filename=f"{icao}_{idx}.png") for idx, img in enumerate(image_objs)]
-        view = ChartSupplementView(discord_files)
-        await itx.followup.send(view=view, files=discord_files)
+        with tempfile.TemporaryDirectory(prefix='amelia-dcs-') as folder:
+            pages = await render_chart_supplement_pages(response, self.bot.renderer, folder)
+            discord_files = [discord.File(path, filename=f"{icao}_{idx}.png") for idx, path in enumerate(pages)]
+            view = ChartSupplementView(discord_files)
+            await itx.followup.send(view=view, files=discord_files)
         #await itx.followup.send(f"Chart Supplement for {icao.upper()}", files=discord_files)
 
 
@@ -146,24 +167,58 @@ class ChartSupplementCOG(commands.Cog):
                 description="We could not find the chart supplement for this airport"
                 )
             await itx.response.send_message(embed=embed, ephemeral=True)
+        elif isinstance(original_error, (RenderQueueFullError, RenderTimeoutError)):
+            await send_render_error(itx, "Chart Supplement Unavailable")
         else:
             await itx.response.send_message("Unable to retrieve chart supplement.", ephemeral=True)
             raise error
 
-def zip_pdfs_to_image(zip_obj: BytesIO) -> BytesIO:
-    image_objs = []
+async def render_chart_supplement(
+        zip_obj: BytesIO,
+        renderer: RenderService,
+        output_folder: str
+) -> AsyncIterator[Tuple[int, pathlib.Path]]:
+    """
+    Renders the first page of every PDF in a chart supplement ZIP to PNG files in ``output_folder``.
+
+    Members are rendered in parallel across the render workers and yielded as ``(index, path)``
+    as soon as each one is written, so completion order is not page order. Only as many PDFs as
+    there are workers are read out of the ZIP at any one time.
+    """
     log.info("Getting Zip File")
     with ZipFile(zip_obj) as zf:
-        for member in zf.namelist():
-            log.info("Processing image")
-            with zf.open(member) as page:
-                image = convert_from_bytes(page.read(), first_page=1, last_page=1)[0]
-                image_bytes = BytesIO()
-                image.save(image_bytes, format='PNG')
-                image_bytes.seek(0)
-                image_objs.append(image_bytes)
-    
-    return image_objs
+        limit = asyncio.Semaphore(renderer.max_workers)
+
+        async def _render(idx: int, member: str) -> Tuple[int, pathlib.Path]:
+            async with limit:
+                with zf.open(member) as page:
+                    pdf = page.read()
+                log.info(f"Processing image {idx}")
+                path = await renderer.render_pdf_page_to_file(pdf, CHART_SUPPLEMENT_DPI, output_folder, f"{idx:03d}")
+                return idx, path
+
+        jobs = [asyncio.ensure_future(_render(idx, member)) for idx, member in enumerate(zf.namelist())]
+        try:
+            for completed in asyncio.as_completed(jobs):
+                yield await completed
+        finally:
+            for job in jobs:
+                job.cancel()
+            # Wait for the cancellations so no job is left writing into output_folder
+            await asyncio.gather(*jobs, return_exceptions=True)
+
+
+async def render_chart_supplement_pages(
+        zip_obj: BytesIO,
+        renderer: RenderService,
+        output_folder: str
+) -> List[pathlib.Path]:
+    """
+    Renders a chart supplement and returns the page images in page order.
+    """
+    async with contextlib.aclosing(render_chart_supplement(zip_obj, renderer, output_folder)) as rendered:
+        pages = [page async for page in rendered]
+    return [path for _, path in sorted(pages)]
     
 async def setup(bot):
     await bot.add_cog(PlatesCog(bot))
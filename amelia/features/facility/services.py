@@ -1,12 +1,18 @@
 import textwrap
+import time
 from io import BytesIO
 from typing import List
 
 import aiohttp
 import discord
-from pdf2image import convert_from_bytes
 
+from amelia.render import RenderService
 from amelia.tfl import FAAPlate
+from .image_cache import PlateImageCache
+
+PLATE_DPI = 200
+
+plate_image_cache = PlateImageCache(name='plate_images')
 
 
 async def pdf_to_memory(url: str) -> BytesIO:
@@ -17,16 +23,15 @@ async def pdf_to_memory(url: str) -> BytesIO:
             return data
 
 
-async def plate_to_image_bytes(plate: FAAPlate) -> BytesIO:
+async def plate_to_image_bytes(plate: FAAPlate, renderer: RenderService) -> BytesIO:
+    cached = await plate_image_cache.get(plate.tpp_cycle, plate.pdf_name, PLATE_DPI)
+    if cached is not None:
+        return cached
+    started = time.perf_counter()
     pdf = await pdf_to_memory(plate.plate_url)
-    image = convert_from_bytes(
-        pdf.read(),
-        first_page=1,
-        last_page=1
-    )[0]
-    image_bytes = BytesIO()
-    image.save(image_bytes, format='PNG')
-    image_bytes.seek(0)
+    image_bytes = await renderer.render_pdf_page(pdf.read(), dpi=PLATE_DPI)
+    plate_image_cache.stats.record_load(time.perf_counter() - started)
+    await plate_image_cache.put(plate.tpp_cycle, plate.pdf_name, PLATE_DPI, image_bytes)
     return image_bytes
 
 
@@ -14,6 +14,5 @@ class ForumChannelDataContext:
         await self.session.execute(q, channel_id)
     
     async def has_auto_pin(self, channel_id: int) -> bool:
-        q = "select count(id) from autopins where parent_id = $1;"
-        count = await self.session.fetchval(q, channel_id)
-        return count > 0
\ No newline at end of file
+        q = "select exists(select 1 from autopins where parent_id = $1);"
+        return await self.session.fetchval(q, channel_id)
\ No newline at end of file
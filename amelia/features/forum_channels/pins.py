@@ -42,7 +42,7 @@ class AutoPinsCog(commands.GroupCog, group_name='autopin'):
         await itx.response.send_message(f"Auto-pins disabled on {channel.name}", ephemeral=True)
 
     async def auto_pin_enabled(self, channel_id: int):
-        async with self.bot.db as session:
+        async with self.bot.db.read(replica=True) as session:
             enabled = await session.forum_channels.has_auto_pin(channel_id)
             return enabled
 
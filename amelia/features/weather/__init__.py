@@ -2,8 +2,10 @@
 from .taf import Taf
 from .metar import Metar
 from .misc import sunset_cmd
+from .prefetch import WeatherPrefetch
 
 async def setup(bot):
     await bot.add_cog(Metar(bot))
     await bot.add_cog(Taf(bot))
+    await bot.add_cog(WeatherPrefetch(bot))
     bot.tree.add_command(sunset_cmd)
@@ -1,5 +1,9 @@
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Optional
+from typing import Optional, Mapping, Any
 from amelia.instances import db
 import asyncpg
 from pydantic import BaseModel, Field
@@ -25,15 +29,80 @@ class AllowedChannel(BaseModel):
     guild_id: int
     channel_id: int
 
-config_cache = FunctionOperationsCache[WeatherConfigSchema]('id')
 
-async def database_change_notify(_: str, action: str, _id: int):
-    if action == "DELETE" or action == "UPDATE":
-        # only invalidate strategy
-        config_cache.invalidate_function_cache_object(_id)
+# Rows read back from the database are trusted, so they skip pydantic validation and
+# map straight onto slotted records. The schemas above are for input. Ids are only unique
+# per table, so records remember the table they were read from.
+
+@dataclass(slots=True)
+class WeatherConfigRecord:
+    table: str
+    id: int
+    guild_id: int
+    restrict_channel: bool
+    delete_interval: int
+    created_at: datetime
+    updated_at: datetime
+
+    @classmethod
+    def from_row(cls, table: str, row: Mapping[str, Any]) -> WeatherConfigRecord:
+        return cls(
+            table, row['id'], row['guild_id'], row['restrict_channel'], row['delete_interval'],
+            row['created_at'], row['updated_at']
+        )
+
+
+@dataclass(slots=True)
+class AllowedChannelRecord:
+    table: str
+    id: int
+    guild_id: int
+    channel_id: int
+    created_at: datetime
+    updated_at: datetime
+
+    @classmethod
+    def from_row(cls, table: str, row: Mapping[str, Any]) -> AllowedChannelRecord:
+        return cls(table, row['id'], row['guild_id'], row['channel_id'], row['created_at'], row['updated_at'])
+
 
+CONFIG_COLUMNS = "id, guild_id, restrict_channel, delete_interval, created_at, updated_at"
+CHANNEL_COLUMNS = "id, guild_id, channel_id, created_at, updated_at"
+CONFIG_TABLES = ('metarconfig', 'tafconfig', 'stationconfig')
+CHANNEL_TABLES = ('metarchannel', 'tafchannel', 'stationchannel')
 
-db.register_listener(database_change_notify, tables=['metarconfig', 'tafconfig', 'stationconfig'])
+# The query text is fixed per table, so asyncpg prepares each one once per connection.
+FETCH_CONFIG_QUERIES = {t: f"select {CONFIG_COLUMNS} from {t} where guild_id = $1;" for t in CONFIG_TABLES}
+FETCH_CHANNELS_QUERIES = {t: f"select {CHANNEL_COLUMNS} from {t} where guild_id = $1;" for t in CHANNEL_TABLES}
+
+config_cache = FunctionOperationsCache[WeatherConfigRecord | AllowedChannelRecord](
+     ('table', 'id'),
+     max_size=1024,
+     ttl=float(os.environ.get('WEATHER_CONFIG_CACHE_TTL', 600)),
+     name='weather_config'
+)
+
+NEGATIVE_TTL = float(os.environ.get('WEATHER_CONFIG_NEGATIVE_TTL', 120))
+
+async def database_change_notify(table: str, action: str, _id: int):
+    if action == "DELETE" or action == "UPDATE":
+        # only invalidate strategy
+        config_cache.invalidate_function_cache_object((table, _id))
+    if action == "INSERT" and table in CONFIG_TABLES:
+        # Configurations are one per guild, so a new row can only make a cached
+        # missing configuration stale.
+        config_cache.invalidate_negative()
+    elif action == "INSERT":
+        # A new channel cannot be traced back to the cached lists it belongs to.
+        # Channel changes are rare, start over.
+        config_cache.clear()
+
+
+db.register_listener(
+     database_change_notify,
+     tables=[*CONFIG_TABLES, *CHANNEL_TABLES]
+)
+db.register_flush_listener(config_cache.clear)
 
 class WeatherDataContext:
 
@@ -58,7 +127,7 @@ class WeatherDataContext:
           return WeatherConfigSchema(**values)
 
      async def _create_channel(self, table: str, schema: AllowedChannel) -> AllowedChannel:
-          q = f"insert into {table} (guild_id, channel_id) values ($1, $2) returning *"
+          q = f"insert into {table} (guild_id, channel_id) values ($1, $2) returning {CHANNEL_COLUMNS}"
           result = await self.session.fetchrow(q, schema.guild_id, schema.channel_id)
           return AllowedChannel(**result) # type: ignore
 
@@ -72,47 +141,43 @@ class WeatherDataContext:
      async def create_or_update_station_configuration(self, schema: WeatherConfigSchema) -> WeatherConfigSchema:
           return await self._create_or_update_configuration("stationconfig", schema)
 
-     async def _fetch_config_table(self, table: str, guild_id: int) -> Optional[WeatherConfigSchema]:
-          q = f"""select * from {table} where guild_id = $1;"""
-          result = await self.session.fetchrow(q, guild_id)
-          log.info(q)
-          log.info(result)
+     async def _fetch_config_table(self, table: str, guild_id: int) -> Optional[WeatherConfigRecord]:
+          result = await self.session.fetchrow(FETCH_CONFIG_QUERIES[table], guild_id)
           if result is None:
                return None
-          return WeatherConfigSchema(**result)
+          return WeatherConfigRecord.from_row(table, result)
 
-     async def _get_allowed_channels(self, table: str, guild_id: int) -> list[AllowedChannel]:
-          q = f"select * from {table} where guild_id = $1;"
-          results = await self.session.fetch(q, guild_id)
-          return [AllowedChannel(**r) for r in results]
+     async def _get_allowed_channels(self, table: str, guild_id: int) -> list[AllowedChannelRecord]:
+          results = await self.session.fetch(FETCH_CHANNELS_QUERIES[table], guild_id)
+          return [AllowedChannelRecord.from_row(table, r) for r in results]
           
      async def _remove_allowed_channel(self, table: str, channel_id: int) -> None:
           q = f"delete from {table} where channel_id = $1;"
           await self.session.execute(q, channel_id)
 
 
-     @config_cache.function(class_level=True)
-     async def fetch_metar_configuration(self, guild_id: int) -> Optional[WeatherConfigSchema]:
+     @config_cache.function(class_level=True, negative_ttl=NEGATIVE_TTL)
+     async def fetch_metar_configuration(self, guild_id: int) -> Optional[WeatherConfigRecord]:
                return await self._fetch_config_table("metarconfig", guild_id)
 
-     @config_cache.function(class_level=True)
-     async def fetch_taf_configuration(self, guild_id: int) -> Optional[WeatherConfigSchema]:
+     @config_cache.function(class_level=True, negative_ttl=NEGATIVE_TTL)
+     async def fetch_taf_configuration(self, guild_id: int) -> Optional[WeatherConfigRecord]:
                return await self._fetch_config_table("tafconfig", guild_id)
 
-     @config_cache.function(class_level=True)
-     async def fetch_station_configuration(self, guild_id: int) -> Optional[WeatherConfigSchema]:
+     @config_cache.function(class_level=True, negative_ttl=NEGATIVE_TTL)
+     async def fetch_station_configuration(self, guild_id: int) -> Optional[WeatherConfigRecord]:
                return await self._fetch_config_table("stationconfig", guild_id)
 
      @config_cache.function(class_level=True)
-     async def fetch_metar_channels(self, guild_id: int):
+     async def fetch_metar_channels(self, guild_id: int) -> list[AllowedChannelRecord]:
           return await self._get_allowed_channels("metarchannel", guild_id)
 
      @config_cache.function(class_level=True)
-     async def fetch_taf_channels(self, guild_id: int):
+     async def fetch_taf_channels(self, guild_id: int) -> list[AllowedChannelRecord]:
           return await self._get_allowed_channels("tafchannel", guild_id)
 
      @config_cache.function(class_level=True)
-     async def fetch_station_channels(self, guild_id: int):
+     async def fetch_station_channels(self, guild_id: int) -> list[AllowedChannelRecord]:
           return await self._get_allowed_channels("stationchannel", guild_id)
 
      
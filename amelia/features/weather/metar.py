@@ -1,11 +1,15 @@
+import asyncio
 import logging
-from typing import TYPE_CHECKING
+import os
+from typing import TYPE_CHECKING, Optional, Tuple
 
+import aiohttp
 import discord
 from discord import Interaction, app_commands
 from discord.ext import commands
 
 from .config import MetarConfigGroup
+from .prefetch import metar_demand
 from .services import get_digital_atis, make_metar_embed, convert_allowed_channels_to_discord
 from amelia.tfl import StationHasNoDataError
 
@@ -13,6 +17,8 @@ if TYPE_CHECKING:
     from amelia.bot import AmeliaBot
 log = logging.getLogger(__name__)
 
+DATIS_TIMEOUT = float(os.environ.get('DATIS_TIMEOUT', 1.5))
+
 
 class Metar(commands.Cog):
 
@@ -21,9 +27,23 @@ class Metar(commands.Cog):
         self.bot = bot
         self._config: MetarConfigGroup | None = None
 
+    async def _get_restrictions(self, guild: discord.Guild) -> Tuple[bool, list[discord.TextChannel]]:
+        async with self.bot.db.read() as session:
+            config = await session.weather.fetch_metar_configuration(guild.id)
+            allowed_channels = await session.weather.fetch_metar_channels(guild.id)
+        restricted = bool(config and config.restrict_channel)
+        return restricted, convert_allowed_channels_to_discord(guild, allowed_channels)
+
+    async def _get_datis(self, icao: str) -> Optional[str]:
+        # D-ATIS is a nice-to-have. Never let it hold up the METAR itself.
+        try:
+            return await asyncio.wait_for(get_digital_atis(icao), timeout=DATIS_TIMEOUT)
+        except (asyncio.TimeoutError, aiohttp.ClientError, ValueError, KeyError, IndexError, AttributeError) as e:
+            log.debug(f"Digital ATIS unavailable for {icao}: {e!r}")
+            return None
+
     async def _get_metar_embed(self, icao: str, display_name: str, avatar_url: str):
-        metar = await self.bot.tfl.fetch_metar(icao)
-        datis = await get_digital_atis(icao)
+        metar, datis = await asyncio.gather(self.bot.tfl.fetch_metar(icao), self._get_datis(icao))
         embed = make_metar_embed(metar)
         text = f"{display_name} | Not an official source for flight planning"
         embed.set_footer(text=text, icon_url=avatar_url)
@@ -41,12 +61,11 @@ class Metar(commands.Cog):
     async def metar_app_cmd(self, itx: Interaction, icao: str):
         if itx.guild is None or itx.channel is None or not isinstance(itx.channel, discord.TextChannel):
             return
-        async with self.bot.db as session:
-            config = await session.weather.fetch_metar_configuration(itx.guild.id)
-            restricted = config and config.restrict_channel
-            allowed_channels = await session.weather.fetch_metar_channels(itx.guild.id)
-            allowed_channels = convert_allowed_channels_to_discord(itx.guild, allowed_channels) 
-        embed = await self._get_metar_embed(icao, itx.user.display_name, itx.user.display_avatar.url)
+        metar_demand.record(icao)
+        (restricted, allowed_channels), embed = await asyncio.gather(
+            self._get_restrictions(itx.guild),
+            self._get_metar_embed(icao, itx.user.display_name, itx.user.display_avatar.url)
+        )
         message = ""
         ephemeral = False
         if restricted and itx.channel not in allowed_channels:
@@ -1,20 +1,24 @@
+from __future__ import annotations
+
 from datetime import datetime
+from typing import TYPE_CHECKING
 
 import discord
 
 from amelia.sun import SunService
-from amelia.tfl import TFLService
 from discord import app_commands, Interaction
 from dateutil.parser import parse
+if TYPE_CHECKING:
+    from amelia.bot import AmeliaBot
 
 
 @app_commands.command(name='sunset', description='Find out when sunset occurs for logging practices')
 @app_commands.describe(icao="The airport ICAO to lookup sunset information for. ex: KLGB")
 async def sunset_cmd(itx: Interaction, icao: str):
     icao = icao.upper()
-    tfl = TFLService()
+    bot: AmeliaBot = itx.client # type: ignore
     service = SunService()
-    airport = await tfl.fetch_airport(icao)
+    airport = await bot.tfl.fetch_airport(icao)
     lat, lon = airport.latitude, airport.longitude
     s = await service.fetch_sun_rise_set(lat, lon)
     if s is None:
@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time as _time
+from datetime import time, timedelta, timezone
+from typing import TYPE_CHECKING, Awaitable, Callable, Dict, List, Tuple
+
+import aiohttp
+from discord.ext import commands, tasks
+
+from amelia.tfl import StationHasNoDataError
+
+if TYPE_CHECKING:
+    from amelia.bot import AmeliaBot
+
+log = logging.getLogger(__name__)
+
+PREFETCH_STATIONS = int(os.environ.get('WEATHER_PREFETCH_STATIONS', 25))
+PREFETCH_SPACING = float(os.environ.get('WEATHER_PREFETCH_SPACING', 0.5))
+
+# Routine METARs are observed around :51-:53 and are usually available upstream a few minutes later.
+METAR_REFRESH_TIMES = [time(hour=h, minute=56, tzinfo=timezone.utc) for h in range(24)]
+# Scheduled TAFs are valid from 00/06/12/18Z and are issued roughly 20-40 minutes ahead.
+TAF_REFRESH_TIMES = [time(hour=h, minute=45, tzinfo=timezone.utc) for h in (5, 11, 17, 23)]
+
+
+class StationDemand:
+    """
+    Tracks how often stations are requested using an exponentially decaying counter,
+    so that stations which were popular yesterday fall off on their own.
+    """
+
+    def __init__(
+            self,
+            half_life: timedelta = timedelta(hours=2),
+            min_score: float = 1.0,
+            clock: Callable[[], float] = _time.monotonic
+    ):
+        self.half_life = half_life.total_seconds()
+        self.min_score = min_score
+        self.clock = clock
+        self._scores: Dict[str, Tuple[float, float]] = {}
+
+    def _decayed(self, score: float, updated: float, now: float) -> float:
+        return score * 0.5 ** ((now - updated) / self.half_life)
+
+    def record(self, icao: str, weight: float = 1.0):
+        icao = icao.upper()
+        now = self.clock()
+        score, updated = self._scores.get(icao, (0.0, now))
+        self._scores[icao] = (self._decayed(score, updated, now) + weight, now)
+
+    def score(self, icao: str) -> float:
+        entry = self._scores.get(icao.upper())
+        if entry is None:
+            return 0.0
+        return self._decayed(*entry, now=self.clock())
+
+    def hottest(self, limit: int) -> List[str]:
+        """
+        Returns up to ``limit`` stations ordered by current demand. Stations that have
+        decayed below ``min_score`` are dropped from tracking.
+        """
+        now = self.clock()
+        scores = {icao: self._decayed(score, updated, now) for icao, (score, updated) in self._scores.items()}
+        for icao, score in scores.items():
+            if score < self.min_score:
+                del self._scores[icao]
+        ranked = sorted((i for i, s in scores.items() if s >= self.min_score), key=scores.__getitem__, reverse=True)
+        return ranked[:limit]
+
+
+metar_demand = StationDemand()
+taf_demand = StationDemand()
+
+
+class WeatherPrefetch(commands.Cog):
+    """
+    Refreshes the most requested stations into the TFL report cache shortly after the
+    reports are expected to be issued, so that popular lookups are served from memory.
+    """
+
+    def __init__(self, bot: AmeliaBot):
+        self.bot = bot
+
+    async def cog_load(self) -> None:
+        self.metar_refresh_task.start()
+        self.taf_refresh_task.start()
+
+    async def cog_unload(self) -> None:
+        self.metar_refresh_task.cancel()
+        self.taf_refresh_task.cancel()
+
+    async def _refresh(self, demand: StationDemand, fetch: Callable[..., Awaitable]):
+        stations = demand.hottest(PREFETCH_STATIONS)
+        log.debug(f"Prefetching {len(stations)} stations")
+        for icao in stations:
+            try:
+                await fetch(icao, refresh=True)
+            except (StationHasNoDataError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                log.debug(f"Prefetch failed for {icao}: {e!r}")
+            except Exception:
+                # A bad payload for one station must not end prefetching for good
+                log.exception(f"Prefetch failed for {icao}")
+            # Spread the refreshes out instead of bursting the upstream API.
+            await asyncio.sleep(PREFETCH_SPACING)
+
+    @tasks.loop(time=METAR_REFRESH_TIMES, reconnect=True)
+    async def metar_refresh_task(self):
+        await self._refresh(metar_demand, self.bot.tfl.fetch_metar)
+
+    @tasks.loop(time=TAF_REFRESH_TIMES, reconnect=True)
+    async def taf_refresh_task(self):
+        await self._refresh(taf_demand, self.bot.tfl.fetch_taf)
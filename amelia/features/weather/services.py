@@ -6,7 +6,8 @@ import aiohttp
 import discord
 
 from amelia import common
-from .data import AllowedChannel
+from amelia.singleflight import SingleFlight
+from .data import AllowedChannelRecord
 from amelia.instances import db
 from .objects import FlightRule
 if TYPE_CHECKING:
@@ -112,21 +113,28 @@ def make_taf_embed(taf_dto: 'TafDTO') -> discord.Embed:
 def depr(command: str):
     return f"This command will no longer work with a future update. Please use {command} going forward"
 
+_datis_flights = SingleFlight()
+
+
 async def get_digital_atis(icao: str) -> Optional[str]:
+    return await _datis_flights.do(icao.upper(), _fetch_digital_atis, icao)
+
+
+async def _fetch_digital_atis(icao: str) -> Optional[str]:
     target = f"http://datis.clowd.io/api/{icao}"
     async with aiohttp.ClientSession() as session:
         async with session.get(target) as resp:
             data = await resp.json()
             if isinstance(data, list):
                 data = data[0]
-            if 'error' in data.keys():
+            if not isinstance(data, dict) or 'error' in data.keys():
                 return
             return data['datis']
 
 
 async def get_allowed_channels(guild: discord.Guild) -> list[discord.TextChannel]:
         container = []
-        async with db as session:
+        async with db.read() as session:
             schemas = await session.weather.fetch_metar_channels(guild.id)
             for sch in schemas:
                 o = discord.utils.get(guild.text_channels, id=sch.channel_id)
@@ -136,7 +144,7 @@ async def get_allowed_channels(guild: discord.Guild) -> list[discord.TextChannel
 
 def convert_allowed_channels_to_discord(
         guild: discord.Guild, 
-        channels: list[AllowedChannel]
+        channels: list[AllowedChannelRecord]
     ) -> list[discord.TextChannel]:
     container = []
     for schema in channels:
@@ -4,6 +4,7 @@ from discord import app_commands, Interaction
 from discord.ext import commands
 
 from .config import TafConfigGroup
+from .prefetch import taf_demand
 from .services import convert_allowed_channels_to_discord, make_taf_embed
 from amelia import tfl
 from typing import TYPE_CHECKING
@@ -27,7 +28,8 @@ class Taf(commands.Cog):
     async def taf_app_cmd(self, itx: Interaction, icao: str):
         if itx.guild is None or itx.channel is None or not isinstance(itx.channel, discord.TextChannel):
             return
-        async with self.bot.db as session:
+        taf_demand.record(icao)
+        async with self.bot.db.read() as session:
             config = await session.weather.fetch_taf_configuration(itx.guild.id)
             restricted = config and config.restrict_channel
             allowed_channels = await session.weather.fetch_taf_channels(itx.guild.id)
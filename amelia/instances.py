@@ -5,6 +5,7 @@ import os
 from typing import TYPE_CHECKING, Optional
 
 from .data import Pg
+from .metrics import registry
 if TYPE_CHECKING:
     from .bot import AmeliaBot
     from .uow import UOW
@@ -15,6 +16,7 @@ _dsn = os.environ['DSN']
 
 
 db: Pg[UOW] = Pg['UOW'](_dsn)
+registry.add_provider(db.metrics)
 bot: Optional[AmeliaBot] = None
 
 
@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import logging
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List
+
+log = logging.getLogger(__name__)
+
+MetricsProvider = Callable[[], Iterable[str]]
+
+
+@dataclass()
+class CacheStats:
+    """
+    Counters for a single cache. Size and weight are read from the cache when asked for.
+    """
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    invalidations: int = 0
+    loads: int = 0
+    load_seconds: float = 0.0
+    size_of: Callable[[], int] = field(default=lambda: 0, repr=False)
+    weight_of: Callable[[], int] = field(default=lambda: 0, repr=False)
+
+    @property
+    def size(self) -> int:
+        return self.size_of()
+
+    @property
+    def weight(self) -> int:
+        return self.weight_of()
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    @property
+    def mean_load_seconds(self) -> float:
+        return self.load_seconds / self.loads if self.loads else 0.0
+
+    def record_load(self, seconds: float):
+        self.loads += 1
+        self.load_seconds += seconds
+
+
+_CACHE_METRICS = (
+    ('hits', 'counter', 'Cache lookups answered from the cache'),
+    ('misses', 'counter', 'Cache lookups that were not in the cache'),
+    ('evictions', 'counter', 'Entries evicted to stay within bounds'),
+    ('expirations', 'counter', 'Entries dropped because they expired'),
+    ('invalidations', 'counter', 'Entries explicitly invalidated'),
+    ('loads', 'counter', 'Values loaded on a miss'),
+    ('load_seconds', 'counter', 'Total time spent loading values on a miss'),
+    ('size', 'gauge', 'Entries currently cached'),
+    ('weight', 'gauge', 'Approximate bytes currently cached, where the cache is weighed'),
+)
+
+
+class MetricsRegistry:
+    """
+    Keeps every named cache's stats, plus any other components that want their metrics
+    included in the Prometheus text dump.
+
+    Registering a name again replaces the previous stats, so reloaded extensions simply
+    take over from the caches they replace.
+    """
+
+    def __init__(self, prefix: str = 'amelia'):
+        self.prefix = prefix
+        self.caches: Dict[str, CacheStats] = {}
+        self._providers: List[MetricsProvider] = []
+
+    def register_cache(self, name: str, stats: CacheStats) -> CacheStats:
+        self.caches[name] = stats
+        return stats
+
+    def add_provider(self, provider: MetricsProvider):
+        """
+        Adds a callable returning Prometheus text format lines to the dump.
+        """
+        if provider not in self._providers:
+            self._providers.append(provider)
+
+    def remove_provider(self, provider: MetricsProvider):
+        if provider in self._providers:
+            self._providers.remove(provider)
+
+    def prometheus(self) -> str:
+        lines: List[str] = []
+        for metric, kind, help_text in _CACHE_METRICS:
+            name = f"{self.prefix}_cache_{metric}" + ('_total' if kind == 'counter' else '')
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for cache_name, stats in sorted(self.caches.items()):
+                lines.append(f'{name}{{cache="{cache_name}"}} {getattr(stats, metric)}')
+        for provider in self._providers:
+            try:
+                lines.extend(provider())
+            except Exception:
+                log.exception(f"Metrics provider {provider!r} failed")
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import asyncio
+import collections
+import inspect
+import logging
+import os
+from typing import Any, Awaitable, Callable, Iterable, List, Optional, OrderedDict, Set, Tuple
+
+log = logging.getLogger(__name__)
+
+NotifyKey = Tuple[str, str, int]
+NotifyCallback = Callable[[str, str, int], Awaitable[Any]]
+FlushCallback = Callable[[], Any]
+
+
+class _Listener:
+
+    def __init__(self, callback: NotifyCallback, tables: Optional[Iterable[str]], concurrency: int):
+        self.callback = callback
+        self.tables = None if tables is None else set(tables)
+        self.concurrency = concurrency
+        self.pending: OrderedDict[NotifyKey, None] = collections.OrderedDict()
+        self.wakeup = asyncio.Event()
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.worker: Optional[asyncio.Task] = None
+        self.running: Set[asyncio.Task] = set()
+
+    def reset(self):
+        # Listeners are registered at import time, give the worker primitives for the current loop.
+        self.wakeup = asyncio.Event()
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+
+    def wants(self, table: str) -> bool:
+        return self.tables is None or table in self.tables
+
+    @property
+    def busy(self) -> bool:
+        return bool(self.pending or self.running)
+
+
+class NotifyDispatcher:
+    """
+    Dispatches database change notifications to listeners off the LISTEN connection.
+
+    Every listener has its own queue and worker, so a slow listener only delays itself.
+    Up to ``concurrency`` callbacks run at once per listener, and a failing callback is
+    logged without affecting the others. Repeats of a ``(table, action, id)`` that is still
+    waiting in a queue are coalesced into the one already queued.
+
+    Queues hold at most ``max_pending`` events. On overflow the queue is dropped and the
+    flush listeners are called instead, since caches can no longer be invalidated one by one.
+    """
+
+    def __init__(
+            self,
+            max_pending: Optional[int] = None,
+            concurrency: Optional[int] = None,
+    ):
+        if max_pending is None:
+            max_pending = int(os.environ.get('NOTIFY_MAX_PENDING', 1000))
+        if concurrency is None:
+            concurrency = int(os.environ.get('NOTIFY_CONCURRENCY', 4))
+        self.max_pending = max_pending
+        self.concurrency = concurrency
+        self.listeners: List[_Listener] = []
+        self.flush_listeners: List[FlushCallback] = []
+        self.received = 0
+        self.coalesced = 0
+        self.failures = 0
+        self.overflows = 0
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_again = False
+
+    def add_listener(self, callback: NotifyCallback, tables: Optional[Iterable[str]] = None):
+        self.listeners.append(_Listener(callback, tables, self.concurrency))
+
+    def add_flush_listener(self, callback: FlushCallback):
+        self.flush_listeners.append(callback)
+
+    @property
+    def pending(self) -> int:
+        return sum(len(listener.pending) for listener in self.listeners)
+
+    def put(self, table: str, action: str, id: int):
+        self.received += 1
+        key = (table, action, id)
+        for listener in self.listeners:
+            if not listener.wants(table):
+                continue
+            if key in listener.pending:
+                self.coalesced += 1
+                continue
+            if len(listener.pending) >= self.max_pending:
+                log.warning(f"Notify queue for {listener.callback!r} overflowed. Flushing caches")
+                listener.pending.clear()
+                self.overflows += 1
+                self.flush()
+                continue
+            listener.pending[key] = None
+            if listener.worker is None or listener.worker.done():
+                listener.reset()
+                listener.worker = asyncio.create_task(self._work(listener))
+            listener.wakeup.set()
+
+    async def _work(self, listener: _Listener):
+        while True:
+            await listener.wakeup.wait()
+            listener.wakeup.clear()
+            while listener.pending:
+                await listener.semaphore.acquire()
+                if not listener.pending:
+                    # Dropped by an overflow while waiting
+                    listener.semaphore.release()
+                    break
+                key, _ = listener.pending.popitem(last=False)
+                task = asyncio.create_task(self._call(listener, key))
+                listener.running.add(task)
+                task.add_done_callback(listener.running.discard)
+
+    async def _call(self, listener: _Listener, key: NotifyKey):
+        try:
+            await listener.callback(*key)
+        except Exception:
+            self.failures += 1
+            log.exception(f"Notify listener {listener.callback!r} failed for {key}")
+        finally:
+            listener.semaphore.release()
+
+    def flush(self):
+        """
+        Calls every flush listener in the background. Calls made while a flush is running
+        are folded into a single flush after it.
+        """
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush())
+        else:
+            self._flush_again = True
+
+    async def _flush(self):
+        while True:
+            self._flush_again = False
+            for callback in self.flush_listeners:
+                try:
+                    result = callback()
+                    if inspect.isawaitable(result):
+                        await result
+                except Exception:
+                    log.exception(f"Flush listener {callback!r} failed")
+            if not self._flush_again:
+                return
+
+    async def join(self):
+        """
+        Waits until every queued notification and flush has been handled.
+        """
+        while any(listener.busy for listener in self.listeners) or (
+                self._flush_task is not None and not self._flush_task.done()):
+            await asyncio.sleep(0)
+
+    async def close(self):
+        tasks = []
+        for listener in self.listeners:
+            listener.pending.clear()
+            if listener.worker is not None:
+                tasks.append(listener.worker)
+            tasks.extend(listener.running)
+            listener.worker = None
+        if self._flush_task is not None:
+            tasks.append(self._flush_task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import pathlib
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import Any, Callable, Optional, TypeVar
+
+from pdf2image import convert_from_bytes
+
+log = logging.getLogger(__name__)
+
+R = TypeVar('R')
+
+
+class RenderQueueFullError(Exception):
+    pass
+
+
+class RenderTimeoutError(Exception):
+    pass
+
+
+def render_pdf_page(pdf: bytes, dpi: int, page: int = 1) -> bytes:
+    """
+    Rasterizes a single page of a PDF to PNG bytes. Runs inside a worker process.
+    """
+    image = convert_from_bytes(pdf, dpi=dpi, first_page=page, last_page=page)[0]
+    image_bytes = BytesIO()
+    image.save(image_bytes, format='PNG')
+    return image_bytes.getvalue()
+
+
+def render_pdf_page_to_file(pdf: bytes, dpi: int, output_folder: str, output_file: str, page: int = 1) -> str:
+    """
+    Rasterizes a single page of a PDF straight to a PNG file using poppler's own output,
+    so no PIL image is ever held in memory. Runs inside a worker process.
+    """
+    paths = convert_from_bytes(
+        pdf,
+        dpi=dpi,
+        first_page=page,
+        last_page=page,
+        output_folder=output_folder,
+        output_file=output_file,
+        fmt='png',
+        single_file=True,
+        paths_only=True
+    )
+    return paths[0]
+
+
+class RenderService:
+    """
+    Runs CPU heavy rendering in a bounded process pool so the event loop keeps servicing
+    the gateway while PDFs are rasterized.
+
+    At most ``max_queue`` jobs may be pending at once, anything beyond that is rejected with
+    RenderQueueFullError instead of piling up. Each job is given ``timeout`` seconds. A job
+    that times out cannot be interrupted inside its worker, it is abandoned and the worker
+    frees up when poppler finishes. Abandoned jobs count as pending until then.
+    """
+
+    def __init__(
+            self,
+            max_workers: Optional[int] = None,
+            max_queue: Optional[int] = None,
+            timeout: Optional[float] = None,
+    ):
+        if max_workers is None:
+            max_workers = int(os.environ.get('RENDER_MAX_WORKERS', 2))
+        if max_queue is None:
+            max_queue = int(os.environ.get('RENDER_MAX_QUEUE', 16))
+        if timeout is None:
+            timeout = float(os.environ.get('RENDER_TIMEOUT', 30))
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.pending = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def _job_done(self, loop: asyncio.AbstractEventLoop):
+        # Called from the executor's thread once the worker is really done with the job.
+        try:
+            loop.call_soon_threadsafe(self._release)
+        except RuntimeError:
+            # The loop is closed, nobody is counting anymore.
+            pass
+
+    def _release(self):
+        self.pending -= 1
+
+    async def submit(self, func: Callable[..., R], *args: Any) -> R:
+        if self.pending >= self.max_queue:
+            raise RenderQueueFullError
+        loop = asyncio.get_running_loop()
+        try:
+            job = self.executor.submit(func, *args)
+            # Jobs stay counted until their worker finishes, even after they time out.
+            self.pending += 1
+            job.add_done_callback(lambda _: self._job_done(loop))
+            return await asyncio.wait_for(asyncio.wrap_future(job), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            log.warning(f"Render job {func.__name__} timed out after {self.timeout}s")
+            raise RenderTimeoutError
+        except BrokenProcessPool:
+            # A worker died (ie: OOM). Start over with a fresh pool next time.
+            log.error("Render process pool is broken. Recreating")
+            self.close()
+            raise
+
+    async def render_pdf_page(self, pdf: bytes, dpi: int, page: int = 1) -> BytesIO:
+        data = await self.submit(render_pdf_page, pdf, dpi, page)
+        return BytesIO(data)
+
+    async def render_pdf_page_to_file(
+            self,
+            pdf: bytes,
+            dpi: int,
+            output_folder: str | pathlib.Path,
+            output_file: str,
+            page: int = 1
+    ) -> pathlib.Path:
+        path = await self.submit(render_pdf_page_to_file, pdf, dpi, str(output_folder), output_file, page)
+        return pathlib.Path(path)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
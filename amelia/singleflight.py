@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, TypeVar
+
+log = logging.getLogger(__name__)
+
+R = TypeVar('R')
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls for the same key into a single in-flight call.
+
+    The first caller for a key starts the work. Anyone else asking for the same key
+    while it is running awaits the same result (or exception). Once the call finishes
+    the key is forgotten, so the next call starts fresh.
+
+    With ``cancel_abandoned`` the call is cancelled once every waiter has been cancelled,
+    and the last waiter only gives up after the call has unwound. Use it when the call
+    borrows resources from its callers, ie: their database connection.
+    """
+
+    def __init__(self, cancel_abandoned: bool = False):
+        self.cancel_abandoned = cancel_abandoned
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self._waiters: Dict[asyncio.Future, int] = {}
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: Hashable, func: Callable[..., Awaitable[R]], *args, **kwargs) -> R:
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(func(*args, **kwargs))
+            self._calls[key] = future
+            future.add_done_callback(lambda f: self._forget(key, f))
+        else:
+            log.debug(f"Joining in-flight call for {key}")
+        self._waiters[future] = self._waiters.get(future, 0) + 1
+        try:
+            # Shield so that one waiter being cancelled (ie: a timeout) does not cancel
+            # the shared call for everyone else.
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if self.cancel_abandoned and self._waiters[future] == 1 and not future.done():
+                future.cancel()
+                await asyncio.wait([future])
+            raise
+        finally:
+            self._waiters[future] -= 1
+            if not self._waiters[future]:
+                del self._waiters[future]
+
+    def _forget(self, key: Hashable, future: asyncio.Future[Any]):
+        if self._calls.get(key) is future:
+            del self._calls[key]
+        if not future.cancelled():
+            # Mark the exception as retrieved in case every waiter went away.
+            future.exception()
@@ -4,6 +4,8 @@ import aiohttp
 import typing
 import logging
 from datetime import datetime, timezone
+
+from .singleflight import SingleFlight
 log = logging.getLogger(__name__)
 
 SunRiseSetResponse = typing.Optional[typing.Dict[str, typing.Any]]
@@ -12,6 +14,9 @@ class SunRiseSetInvalidException(Exception):
     pass
 
 
+_flights = SingleFlight()
+
+
 class SunService:
     """
     Simple Mixin that will allow a Discord COG to take advantage of Sunrise/Set API
@@ -40,6 +45,11 @@ class SunService:
         -------
         AvwxResponse JSON
         """
+        if kwargs:
+            return await self._sunriseset_get(target, **kwargs)
+        return await _flights.do(target, self._sunriseset_get, target)
+
+    async def _sunriseset_get(self, target, **kwargs) -> SunRiseSetResponse:
         async with aiohttp.ClientSession(headers=self.sunrise_headers) as session:
             try:
                 url = "{0}{1}".format(self.sunrise_api_url, target)
@@ -1,12 +1,16 @@
+import asyncio
 import logging
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import datetime, timedelta
 from decimal import Decimal
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Callable, Awaitable, Set
 
 import aiohttp
 from dateutil import parser
 from urllib.parse import urlencode
+
+from .cache import ReportCache
+from .singleflight import SingleFlight
 log = logging.getLogger(__name__)
 from io import BytesIO
 
@@ -104,25 +108,140 @@ class AirportDTO:
 
 class TFLService:
 
-    def __init__(self, loop=None):
+    def __init__(
+            self,
+            loop=None,
+            max_connections: Optional[int] = None,
+            max_connections_per_host: Optional[int] = None,
+            dns_cache_ttl: Optional[int] = None,
+            keepalive_timeout: Optional[float] = None,
+    ):
+        if max_connections is None:
+            max_connections = int(os.environ.get('TFL_MAX_CONNECTIONS', 100))
+        if max_connections_per_host is None:
+            max_connections_per_host = int(os.environ.get('TFL_MAX_CONNECTIONS_PER_HOST', 20))
+        if dns_cache_ttl is None:
+            dns_cache_ttl = int(os.environ.get('TFL_DNS_CACHE_TTL', 300))
+        if keepalive_timeout is None:
+            keepalive_timeout = float(os.environ.get('TFL_KEEPALIVE_TIMEOUT', 60))
         self.api_url = os.environ.get('TFL_API', 'http://api.theflying.life/api/v1')
         self.headers = {}
         self.plates = Plates(self._request)
+        self.max_connections = max_connections
+        self.max_connections_per_host = max_connections_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.metar_cache = ReportCache[MetarDTO](
+            observed_at=lambda m: m.valid,
+            max_age=timedelta(minutes=int(os.environ.get('METAR_CACHE_MAX_AGE', 60))),
+            name='metar_reports'
+        )
+        self.taf_cache = ReportCache[TafDTO](
+            observed_at=lambda t: t.issue_time,
+            max_age=timedelta(minutes=int(os.environ.get('TAF_CACHE_MAX_AGE', 360))),
+            name='taf_reports'
+        )
+        self._flights = SingleFlight()
+        self._revalidating: Set[str] = set()
+        self._background: Set[asyncio.Task] = set()
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """
+        The long-lived pooled session. Created lazily so that the service can be
+        constructed outside of a running event loop.
+        """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.max_connections,
+                limit_per_host=self.max_connections_per_host,
+                ttl_dns_cache=self.dns_cache_ttl,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(headers=self.headers, connector=connector)
+        return self._session
+
+    async def start(self):
+        _ = self.session
+        log.debug("TFL Service session started")
+
+    async def close(self):
+        for task in list(self._background):
+            task.cancel()
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _request(self, target, **kwargs) -> Dict[str, Any]:
+        url = "{0}{1}".format(self.api_url, target)
+        if kwargs:
+            return await self._get_json(url, **kwargs)
+        # Identical concurrent requests share one upstream call. Results are shared between
+        # callers so they must not be mutated.
+        return await self._flights.do(url, self._get_json, url)
 
-    async def _request(self, target, session=None, **kwargs) -> Dict[str, Any]:
+    async def _get_json(self, url: str, **kwargs) -> Dict[str, Any]:
         try:
-            async with aiohttp.ClientSession(headers=self.headers) as session:
-                url = "{0}{1}".format(self.api_url, target)
-                async with session.get(url, **kwargs) as response:
-                    status = response.status
-                    result = await response.json()
-                    log.debug(f"FETCH {status}: {url}")
-                    return result
+            async with self.session.get(url, **kwargs) as response:
+                status = response.status
+                result = await response.json()
+                log.debug(f"FETCH {status}: {url}")
+                return result
         except aiohttp.ClientResponseError as e:
             log.error(e)
             raise
 
-    async def fetch_metar(self, icao: str) -> MetarDTO:
+    async def _cached_report(
+            self,
+            cache: ReportCache,
+            icao: str,
+            loader: Callable[[str], Awaitable[Any]],
+            refresh: bool
+    ):
+        key = icao.upper()
+        entry = None if refresh else cache.entry(key)
+        if entry is not None:
+            report, fresh = entry
+            if not report.last_polling_succeeded:
+                # Upstream is serving stale data itself. Hand back what we have and
+                # check again in the background rather than making the user wait.
+                self._revalidate(cache, key, loader)
+                return report
+            if fresh:
+                return report
+        report = await loader(key)
+        cache.put(key, report)
+        return report
+
+    def _revalidate(self, cache: ReportCache, key: str, loader: Callable[[str], Awaitable[Any]]):
+        marker = f"{id(cache)}:{key}"
+        if marker in self._revalidating:
+            return
+
+        async def _run():
+            try:
+                cache.put(key, await loader(key))
+            except (StationHasNoDataError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                log.debug(f"Revalidation failed for {key}: {e!r}")
+            except Exception:
+                # Nobody awaits this task, so anything else would go unreported
+                log.exception(f"Revalidation failed for {key}")
+            finally:
+                self._revalidating.discard(marker)
+
+        self._revalidating.add(marker)
+        task = asyncio.ensure_future(_run())
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def fetch_metar(self, icao: str, refresh: bool = False) -> MetarDTO:
+        return await self._cached_report(self.metar_cache, icao, self._fetch_metar, refresh)
+
+    async def fetch_taf(self, icao: str, refresh: bool = False) -> TafDTO:
+        return await self._cached_report(self.taf_cache, icao, self._fetch_taf, refresh)
+
+    async def _fetch_metar(self, icao: str) -> MetarDTO:
         target = f'/metar/{icao}'
         r = await self._request(target)
         if r is None:
@@ -143,7 +262,7 @@ class TFLService:
             last_polling_succeeded=r['last_polling_succeeded']
         )
 
-    async def fetch_taf(self, icao: str) -> TafDTO:
+    async def _fetch_taf(self, icao: str) -> TafDTO:
         target = f'/taf/{icao}'
         r = await self._request(target)
         if r is None:
@@ -166,21 +285,20 @@ class TFLService:
         if r is None:
             raise StationHasNoDataError
         plates = [FAAPlate(**p) for p in r['plates']]
-        del r['plates']
-        return AirportDTO(**r, plates=plates)
+        fields = {k: v for k, v in r.items() if k != 'plates'}
+        return AirportDTO(**fields, plates=plates)
     
     async def fetch_chart_supplement(self, icao: str) -> BytesIO | None:
         log.info("In chart supplement")
         target = f'/dcs/{icao}'
-        async with aiohttp.ClientSession(headers=self.headers) as session:
-            url = "{0}{1}".format(self.api_url, target)
-            log.info(f"Calling: {url}")
-            async with session.get(url) as response:
-                if response.content_type != "application/x-zip-compressed":
-                    return
-                data = await response.read()
-                data = BytesIO(data)
-                return data
+        url = "{0}{1}".format(self.api_url, target)
+        log.info(f"Calling: {url}")
+        async with self.session.get(url) as response:
+            if response.content_type != "application/x-zip-compressed":
+                return
+            data = await response.read()
+            data = BytesIO(data)
+            return data
 
 
 class Plates:
@@ -0,0 +1,56 @@
+"""
+Compares the original full scan autocomplete path against the indexed matcher.
+
+    python -m benchmarks.autocomplete
+"""
+import asyncio
+import itertools
+import random
+import string
+import time
+
+from amelia.auto_choices import FuzzyChoicesCache, fuzzy_best
+
+
+def make_icaos() -> list[str]:
+    letters = string.ascii_uppercase
+    icaos = [f"K{a}{b}{c}" for a, b, c in itertools.product(letters, repeat=3)]
+    icaos += [f"{p}{a}{b}{c}" for p in 'CPT' for a, b, c in itertools.product(letters[:12], repeat=3)]
+    return icaos
+
+
+def legacy_retrieve(text: str, items: list[str], threshold: int) -> list[str]:
+    best_matches = fuzzy_best(text, items, threshold)
+    return [c for c in items if c in best_matches]
+
+
+async def main(rounds: int = 50):
+    icaos = make_icaos()
+    random.seed(1)
+    queries = ['k', 'ks', 'ksn', 'ksna', 'klgb', 'kjfk', 'sna', 'lax', 'cyvr'] + random.sample(icaos, 11)
+
+    async def fetch():
+        return icaos
+
+    cache = FuzzyChoicesCache(fetch_method=fetch)
+    await cache.refresh()
+
+    start = time.perf_counter()
+    for q in queries[:rounds]:
+        legacy_retrieve(q, icaos, 7)
+    legacy = (time.perf_counter() - start) / len(queries[:rounds])
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for q in queries:
+            await cache.retrieve(q)
+    indexed = (time.perf_counter() - start) / (rounds * len(queries))
+
+    print(f"{len(icaos)} items, {len(queries)} queries")
+    print(f"legacy full scan: {legacy * 1000:8.2f} ms/query")
+    print(f"indexed matcher:  {indexed * 1000:8.2f} ms/query")
+    print(f"speedup:          {legacy / indexed:8.1f}x")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -23,6 +23,7 @@ async def bootstrap():
     from amelia.instances import db
     log.info(f"Discord Version: {discord.__version__}")
     db.migrate()
+    await db.create_pool()
     await db.start_listening()
     intents = discord.Intents.default()
     intents.message_content = True
@@ -46,6 +47,8 @@ async def bootstrap():
         pass
     finally:
         await bot.close()
+        await db.stop_listening()
+        await db.close()
 
 
 
@@ -0,0 +1,47 @@
+import pytest
+
+from amelia.auto_choices import FuzzyChoicesCache, NGramMatcher, fuzzy_choices
+from discord import app_commands
+
+ICAOS = ['KSNA', 'KLAX', 'KLGB', 'KSAN', 'KSFO', 'KJFK', 'KSEA', 'CYVR']
+
+
+def test_ngram_matcher_ranks_exact_match_first():
+    matcher = NGramMatcher()
+    matcher.index(ICAOS)
+    assert matcher.match('ksna', threshold=7)[0] == 'KSNA'
+    assert matcher.match('lgb', threshold=7) == ['KLGB']
+
+
+def test_ngram_matcher_short_queries_use_prefix_and_limit():
+    matcher = NGramMatcher()
+    matcher.index(ICAOS)
+    results = matcher.match('ks', threshold=100, limit=3)
+    assert len(results) == 3
+    assert all(r.startswith('KS') for r in results)
+    assert matcher.match('', threshold=7, limit=2) == ICAOS[:2]
+    assert matcher.match('zzzz', threshold=7) == []
+
+
+def test_ngram_matcher_short_queries_match_inside_items():
+    matcher = NGramMatcher()
+    matcher.index(ICAOS)
+    assert matcher.match('LA', threshold=7) == ['KLAX']
+    assert matcher.match('s', threshold=100)[:4] == ['KSNA', 'KSAN', 'KSFO', 'KSEA']
+
+
+@pytest.mark.asyncio
+async def test_fuzzy_choices_cache_returns_prebuilt_choices():
+    async def fetch():
+        return ICAOS
+
+    cache = FuzzyChoicesCache(fetch_method=fetch)
+    choices = await cache.retrieve('kjfk')
+    assert choices[0] == app_commands.Choice(name='KJFK', value='KJFK')
+    assert len(await cache.retrieve('')) == len(ICAOS)
+
+
+def test_fuzzy_choices_ranks_plate_names():
+    choices = [app_commands.Choice(name=n, value=n) for n in ('RNAV (GPS) RWY 20R', 'ILS OR LOC RWY 20R', 'VOR RWY 2')]
+    results = fuzzy_choices('ils', choices, threshold=7)
+    assert results[0].name == 'ILS OR LOC RWY 20R'
@@ -1,10 +1,12 @@
 
+from datetime import datetime, timezone
+
 import pytest
 import pytest_asyncio
 from polyfactory.factories.pydantic_factory import ModelFactory
 
 from amelia.features.autorole.data import AutoRoleDataContext
-from amelia.features.autorole.schema import AutoRoleSchema
+from amelia.features.autorole.schema import AutoRoleSchema, AutoRoleRecord
 
 
 class AutoRoleFactory(ModelFactory[AutoRoleSchema]):
@@ -55,4 +57,9 @@ async def test_autorole_all_roles(ctx_with_guild):
 
 
 
-
+def test_autorole_record_from_row():
+    now = datetime.now(timezone.utc)
+    row = {'id': 1, 'guild_id': 2, 'role_id': 3, 'created_at': now, 'updated_at': now}
+    record = AutoRoleRecord.from_row(row)
+    assert record.role_id == 3 and record.updated_at == now
+    assert not hasattr(record, '__dict__')
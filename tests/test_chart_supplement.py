@@ -0,0 +1,97 @@
+import asyncio
+import pathlib
+from io import BytesIO
+from zipfile import ZipFile
+
+import pytest
+
+from amelia.features.facility.plates import render_chart_supplement, render_chart_supplement_pages
+from amelia.render import RenderQueueFullError
+
+
+def make_zip(*pages: bytes) -> BytesIO:
+    buffer = BytesIO()
+    with ZipFile(buffer, 'w') as zf:
+        for idx, page in enumerate(pages):
+            zf.writestr(f'page{idx}.pdf', page)
+    buffer.seek(0)
+    return buffer
+
+
+class FakeRenderer:
+    """
+    Renders a "pdf" holding its own render time in seconds by writing it back out to a file.
+    """
+
+    def __init__(self, max_workers: int = 2):
+        self.max_workers = max_workers
+        self.in_flight = 0
+        self.most_in_flight = 0
+        self.started = []
+        self.cancelled = []
+
+    async def render_pdf_page_to_file(self, pdf, dpi, output_folder, output_file, page=1):
+        self.started.append(output_file)
+        self.in_flight += 1
+        self.most_in_flight = max(self.most_in_flight, self.in_flight)
+        try:
+            if pdf == b'full':
+                await asyncio.sleep(0.01)
+                raise RenderQueueFullError
+            await asyncio.sleep(float(pdf))
+        except asyncio.CancelledError:
+            self.cancelled.append(output_file)
+            raise
+        finally:
+            self.in_flight -= 1
+        path = pathlib.Path(output_folder) / f'{output_file}.png'
+        path.write_bytes(pdf)
+        return path
+
+
+@pytest.mark.asyncio
+async def test_chart_supplement_pages_are_returned_in_page_order(tmp_path):
+    pages = (b'0.05', b'0.01', b'0.03')
+    renderer = FakeRenderer(max_workers=3)
+    rendered = render_chart_supplement(make_zip(*pages), renderer, str(tmp_path)) # type: ignore
+    completed = [idx async for idx, _ in rendered]
+    assert completed == [1, 2, 0]
+    paths = await render_chart_supplement_pages(make_zip(*pages), renderer, str(tmp_path)) # type: ignore
+    assert [p.read_bytes() for p in paths] == list(pages)
+
+
+@pytest.mark.asyncio
+async def test_chart_supplement_renders_at_most_max_workers_at_once(tmp_path):
+    renderer = FakeRenderer(max_workers=2)
+    paths = await render_chart_supplement_pages(make_zip(*[b'0.01'] * 6), renderer, str(tmp_path)) # type: ignore
+    assert len(paths) == 6
+    assert renderer.most_in_flight == 2
+
+
+@pytest.mark.asyncio
+async def test_chart_supplement_failure_cancels_remaining_renders(tmp_path):
+    renderer = FakeRenderer(max_workers=2)
+    with pytest.raises(RenderQueueFullError):
+        await render_chart_supplement_pages(make_zip(b'full', *[b'0.5'] * 4), renderer, str(tmp_path)) # type: ignore
+    # Every render that got going was cancelled, and nothing is left running afterwards
+    started = list(renderer.started)
+    assert sorted(renderer.cancelled) == started[1:]
+    assert renderer.in_flight == 0
+    await asyncio.sleep(0.05)
+    assert renderer.started == started and len(started) < 5
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.asyncio
+async def test_chart_supplement_cancellation_cancels_every_render(tmp_path):
+    renderer = FakeRenderer(max_workers=2)
+    rendering = render_chart_supplement_pages(make_zip(*[b'0.5'] * 4), renderer, str(tmp_path)) # type: ignore
+    task = asyncio.ensure_future(rendering)
+    while len(renderer.started) < 2:
+        await asyncio.sleep(0)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert sorted(renderer.cancelled) == renderer.started
+    assert renderer.in_flight == 0
+    assert list(tmp_path.iterdir()) == []
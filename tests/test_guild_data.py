@@ -62,4 +62,29 @@ async def test_guild_context_fetch_guild(ctx: GuildDataContext):
     id_num = o.id or -1
     missing_id = id_num + 1
     not_found = await ctx.fetch_guild(missing_id)
-    assert not_found is None
\ No newline at end of file
+    assert not_found is None
+
+
+@pytest.mark.asyncio
+async def test_guild_context_upsert_many(ctx: GuildDataContext):
+    existing = await ctx.upsert(GuildFactory.build(id=None, member_count=1))
+    existing.member_count = 10
+    new = GuildFactory.build(id=None, member_count=3)
+    await ctx.upsert_many([existing, new])
+    count = await ctx.session.fetchval("select count(id) from guilds;")
+    assert count == 2
+    fetched = await ctx.fetch_guild(existing.guild_id)
+    assert fetched is not None and fetched.member_count == 10
+    fetched = await ctx.fetch_guild(new.guild_id)
+    assert fetched is not None and fetched.member_count == 3
+
+@pytest.mark.asyncio
+async def test_apply_member_count_deltas(ctx: GuildDataContext):
+    o = await ctx.upsert(GuildFactory.build(id=None, member_count=10))
+    empty = await ctx.upsert(GuildFactory.build(id=None, member_count=None))
+    missing = await ctx.apply_member_count_deltas({o.guild_id: 3, empty.guild_id: 2, 123: 1})
+    assert missing == [123]
+    fetched = await ctx.fetch_guild(o.guild_id)
+    assert fetched is not None and fetched.member_count == 13
+    fetched = await ctx.fetch_guild(empty.guild_id)
+    assert fetched is not None and fetched.member_count == 2
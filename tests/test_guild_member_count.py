@@ -0,0 +1,115 @@
+from types import SimpleNamespace
+
+import discord
+import pytest
+
+from amelia.concepts.guild.cogs import GuildFeatures
+from amelia.concepts.guild.member_counts import MemberCountBuffer
+
+
+class FakeBot:
+
+    def __init__(self, guilds):
+        self.guilds = guilds
+        self.fetched = []
+
+    async def fetch_guild(self, guild_id, with_counts=False):
+        self.fetched.append(guild_id)
+        return SimpleNamespace(approximate_member_count=100)
+
+
+def make_guild(guild_id, chunked, member_count):
+    return SimpleNamespace(id=guild_id, chunked=chunked, member_count=member_count, approximate_member_count=None)
+
+
+@pytest.mark.asyncio
+async def test_chunked_guilds_use_gateway_counts():
+    chunked, unchunked = make_guild(1, True, 42), make_guild(2, False, 7)
+    bot = FakeBot([chunked, unchunked])
+    cog = GuildFeatures(bot) # type: ignore
+    counts = await cog.collect_guild_member_counts()
+    assert counts == {1: 42, 2: 100}
+    assert bot.fetched == [2]
+
+
+def test_member_count_buffer_aggregates_and_drains():
+    buffer = MemberCountBuffer()
+    buffer.record(1, 1)
+    buffer.record(1, 1)
+    buffer.record(2, 1)
+    buffer.record(2, -1)
+    assert buffer.drain() == {1: 2}
+    assert len(buffer) == 0
+    buffer.record(1, 1)
+    buffer.restore({1: 2})
+    assert buffer.drain() == {1: 3}
+
+
+class FailingDb:
+
+    async def __aenter__(self):
+        raise OSError('connection refused')
+
+    async def __aexit__(self, *args):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_failed_flush_keeps_deltas():
+    bot = FakeBot([])
+    bot.db = FailingDb()
+    cog = GuildFeatures(bot) # type: ignore
+    cog.member_counts.record(1, 5)
+    await cog.flush_member_counts()
+    assert cog.member_counts.drain() == {1: 5}
+
+
+class GuildsSession:
+
+    def __init__(self, missing):
+        self.guilds = SimpleNamespace(
+            apply_member_count_deltas=self.apply_member_count_deltas,
+            upsert_many=self.upsert_many
+        )
+        self.missing = missing
+
+    async def apply_member_count_deltas(self, deltas):
+        return self.missing
+
+    async def upsert_many(self, schemas):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+
+class UnreachableBot(FakeBot):
+
+    async def fetch_guild(self, guild_id, with_counts=False):
+        raise discord.HTTPException(SimpleNamespace(status=503, reason='Service Unavailable'), 'unavailable')
+
+    def get_guild(self, guild_id):
+        return next((g for g in self.guilds if g.id == guild_id), None)
+
+
+@pytest.mark.asyncio
+async def test_flush_keeps_deltas_when_a_new_guild_count_cannot_be_fetched():
+    bot = UnreachableBot([make_guild(1, False, None)])
+    bot.db = GuildsSession(missing=[1])
+    cog = GuildFeatures(bot) # type: ignore
+    cog.member_counts.record(1, 2)
+    await cog.flush_member_counts()
+    assert cog.member_counts.drain() == {1: 2}
+
+
+@pytest.mark.asyncio
+async def test_refreshed_counts_drop_buffered_deltas():
+    bot = FakeBot([make_guild(1, True, 42)])
+    cog = GuildFeatures(bot) # type: ignore
+    cog.member_counts.record(1, 3)
+    cog.member_counts.record(2, 1)
+    await cog.collect_guild_member_counts()
+    assert cog.member_counts.drain() == {2: 1}
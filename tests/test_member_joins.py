@@ -0,0 +1,175 @@
+import asyncio
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from amelia.concepts.guild.joins import MemberJoinPipeline
+from amelia.features.autorole.autorole import AutoRole
+from amelia.features.autorole.data import AutoRoleDataContext, cache as auto_role_cache
+
+
+def make_member(member_id, guild_id=1, roles=None):
+    return SimpleNamespace(id=member_id, guild=SimpleNamespace(id=guild_id, name='guild'), roles=roles or [])
+
+
+@pytest.mark.asyncio
+async def test_pipeline_runs_steps_in_order():
+    pipeline = MemberJoinPipeline(workers=1)
+    seen = []
+
+    async def first(member):
+        seen.append(('first', member.id))
+
+    async def second(member):
+        seen.append(('second', member.id))
+
+    pipeline.register(first)
+    pipeline.register(second)
+    pipeline.register(first)
+    pipeline.submit(make_member(1)) # type: ignore
+    pipeline.submit(make_member(2)) # type: ignore
+    await pipeline.join()
+    await pipeline.close()
+    assert seen == [('first', 1), ('second', 1), ('first', 2), ('second', 2)]
+
+
+@pytest.mark.asyncio
+async def test_pipeline_failing_step_does_not_stop_others():
+    pipeline = MemberJoinPipeline(workers=1)
+    seen = []
+
+    async def broken(member):
+        raise RuntimeError("boom")
+
+    async def working(member):
+        seen.append(member.id)
+
+    pipeline.register(broken)
+    pipeline.register(working)
+    pipeline.submit(make_member(1)) # type: ignore
+    await pipeline.join()
+    await pipeline.close()
+    assert seen == [1]
+
+
+@pytest.mark.asyncio
+async def test_pipeline_drops_joins_when_full():
+    pipeline = MemberJoinPipeline(max_size=1, workers=1)
+    release = asyncio.Event()
+    started = asyncio.Event()
+
+    async def slow(member):
+        started.set()
+        await release.wait()
+
+    pipeline.register(slow)
+    pipeline.submit(make_member(1)) # type: ignore
+    await started.wait()
+    pipeline.submit(make_member(2)) # type: ignore
+    pipeline.submit(make_member(3)) # type: ignore
+    assert pipeline.dropped == 1
+    release.set()
+    await pipeline.join()
+    await pipeline.close()
+
+
+class FakeConnection:
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    async def fetch(self, query, guild_id):
+        return [r for r in self.rows if r['guild_id'] == guild_id]
+
+
+class FakeDb:
+
+    def __init__(self, rows):
+        self.connection = FakeConnection(rows)
+        self.reads = 0
+
+    def read(self):
+        db = self
+
+        class _Read:
+            async def __aenter__(self):
+                db.reads += 1
+                return SimpleNamespace(auto_roles=AutoRoleDataContext(db.connection)) # type: ignore
+
+            async def __aexit__(self, *exc):
+                return False
+        return _Read()
+
+
+def make_role(role_id, assignable=True):
+    return SimpleNamespace(id=role_id, name=str(role_id), is_assignable=lambda: assignable)
+
+
+@pytest.fixture()
+def auto_role_cog():
+    roles = [make_role(10), make_role(11), make_role(12), make_role(13, assignable=False)]
+    now = datetime.now(timezone.utc)
+    rows = [
+        {'id': i, 'guild_id': 1, 'role_id': r.id, 'created_at': now, 'updated_at': now}
+        for i, r in enumerate(roles)
+    ]
+    db = FakeDb(rows)
+    yield AutoRole(SimpleNamespace(db=db)), db, roles # type: ignore
+    auto_role_cache.clear()
+
+
+@pytest.mark.asyncio
+async def test_auto_roles_are_added_in_one_call(auto_role_cog):
+    cog, db, roles = auto_role_cog
+    calls = []
+
+    async def add_roles(*args, reason=None):
+        calls.append(args)
+
+    for member_id in (1, 2):
+        member = make_member(member_id, roles=[roles[1]])
+        member.guild.roles = roles
+        member.add_roles = add_roles
+        await cog.assign_auto_roles(member)
+    # The unassignable role is left out instead of failing the whole request
+    assert calls == [(roles[0], roles[2]), (roles[0], roles[2])]
+    # The second join is served from the cache without a connection
+    assert db.reads == 1
+
+
+@pytest.mark.asyncio
+async def test_pipeline_close_drains_queued_joins_and_rejects_new_ones():
+    pipeline = MemberJoinPipeline(workers=1, drain_timeout=1)
+    seen = []
+
+    async def step(member):
+        await asyncio.sleep(0.01)
+        seen.append(member.id)
+
+    pipeline.register(step)
+    for member_id in (1, 2, 3):
+        pipeline.submit(make_member(member_id)) # type: ignore
+    await pipeline.close()
+    assert seen == [1, 2, 3]
+    pipeline.submit(make_member(4)) # type: ignore
+    assert pipeline.dropped == 1 and not pipeline._tasks
+
+
+@pytest.mark.asyncio
+async def test_pipeline_close_gives_up_after_the_drain_timeout():
+    pipeline = MemberJoinPipeline(workers=1, drain_timeout=0.01)
+    cancelled = []
+
+    async def stuck(member):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(member.id)
+            raise
+
+    pipeline.register(stuck)
+    pipeline.submit(make_member(1)) # type: ignore
+    pipeline.submit(make_member(2)) # type: ignore
+    await pipeline.close()
+    assert cancelled == [1]
@@ -0,0 +1,72 @@
+import pytest
+
+from amelia.auto_choices import FuzzyChoicesCache
+from amelia.cache import LRUCache
+from amelia.metrics import MetricsRegistry, CacheStats, registry
+
+
+def test_lru_cache_counts_lookups():
+    now = 0.0
+    cache = LRUCache[dict](max_size=2, ttl=10, timer=lambda: now)
+    cache.put('a', {'id': 1})
+    cache.get('a')
+    cache.get('b')
+    cache.put('b', {'id': 2})
+    cache.put('c', {'id': 3})
+    assert cache.stats.evictions == 1
+    cache.invalidate('c')
+    now = 20.0
+    cache.get('b')
+    assert cache.stats.hits == 1
+    assert cache.stats.misses == 2
+    assert cache.stats.invalidations == 1
+    assert cache.stats.expirations == 1
+    assert cache.stats.size == 0
+
+
+@pytest.mark.asyncio()
+async def test_function_records_loads():
+    cache = LRUCache[dict]()
+
+    @cache.function()
+    async def some_function(n: int):
+        return {'id': n}
+
+    await some_function(1)
+    await some_function(1)
+    assert cache.stats.loads == 1
+    assert cache.stats.hits == 1
+    assert cache.stats.hit_ratio == 0.5
+
+
+@pytest.mark.asyncio()
+async def test_fuzzy_choices_cache_stats():
+    async def fetch():
+        return ['KDTW', 'KORD']
+
+    cache = FuzzyChoicesCache(fetch)
+    await cache.retrieve('KD')
+    await cache.retrieve('KO')
+    assert cache.stats.misses == 1
+    assert cache.stats.hits == 1
+    assert cache.stats.size == 2
+
+
+def test_named_caches_are_registered():
+    cache = LRUCache[dict](name='test_named')
+    assert registry.caches['test_named'] is cache.stats
+    replacement = LRUCache[dict](name='test_named')
+    assert registry.caches['test_named'] is replacement.stats
+
+
+def test_prometheus_dump():
+    metrics = MetricsRegistry()
+    stats = metrics.register_cache('demo', CacheStats(hits=3, size_of=lambda: 7))
+    stats.misses = 1
+    metrics.add_provider(lambda: ['amelia_listener_queue_depth 4'])
+    text = metrics.prometheus()
+    assert '# TYPE amelia_cache_hits_total counter' in text
+    assert 'amelia_cache_hits_total{cache="demo"} 3' in text
+    assert 'amelia_cache_misses_total{cache="demo"} 1' in text
+    assert 'amelia_cache_size{cache="demo"} 7' in text
+    assert 'amelia_listener_queue_depth 4' in text
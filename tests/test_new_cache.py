@@ -1,6 +1,9 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
 import pytest
 
-from amelia.cache import LRUCache, FunctionOperationsCache
+from amelia.cache import LRUCache, FunctionOperationsCache, ReportCache, sweep_caches
 import logging
 log = logging.getLogger(__name__)
 
@@ -111,3 +114,350 @@ async def test_function_update_cache():
     cache.update_function_cache_object(id1)
     assert cache.preview(id1_id)['name'] == 'bar'
     assert cache.preview(seq1_id)[0]['name'] == 'bar'
+
+
+def test_report_cache_expires_from_observation_time():
+    now = datetime(2023, 1, 1, 12, 0, tzinfo=timezone.utc)
+    cache = ReportCache[dict](
+        observed_at=lambda r: r['valid'],
+        max_age=timedelta(minutes=60),
+        min_ttl=timedelta(minutes=2),
+        clock=lambda: now
+    )
+    cache.put('KLAX', {'valid': now - timedelta(minutes=30)})
+    cache.put('KSNA', {'valid': now - timedelta(minutes=59, seconds=30)})
+    assert cache.get('KLAX') is not None
+    # Past max age, but min_ttl keeps it around for a short while
+    assert cache.get('KSNA') is not None
+
+    now += timedelta(minutes=5)
+    assert cache.get('KLAX') is not None
+    assert cache.get('KSNA') is None
+    # Expired entries are still available for stale serving
+    entry = cache.entry('KSNA')
+    assert entry is not None and entry[1] is False
+
+    # An explicit ttl wins over the report's own expiry
+    cache.put('KJFK', {'valid': now}, ttl=60)
+    now += timedelta(minutes=2)
+    assert cache.get('KJFK') is None
+
+
+@pytest.mark.asyncio()
+async def test_eviction_cleans_up_object_map():
+    cache = FunctionOperationsCache[dict]('id', max_size=2)
+    @cache.function()
+    async def some_function(n: int):
+        return [{'id': n}, {'id': n + 1}]
+
+    for n in range(10):
+        await some_function(n)
+    assert len(cache.cache_ids) == 2
+    assert set(cache.object_map.keys()) == {8, 9, 10}
+    assert set(cache.function_map.keys()) == set(cache.cache_ids)
+
+
+@pytest.mark.asyncio()
+async def test_invalidate_and_update_reach_every_cached_result():
+    cache = FunctionOperationsCache[dict]('id')
+    @cache.function()
+    async def single(n: int):
+        return {'id': n, 'name': 'foo'}
+
+    @cache.function()
+    async def many(n: int):
+        return [{'id': n, 'name': 'foo'}, {'id': n + 1, 'name': 'foo'}]
+
+    await single(2)
+    single_id = cache.last_function_id
+    await many(1)
+    many_id = cache.last_function_id
+    await many(2)
+    other_many_id = cache.last_function_id
+
+    cache.update_function_cache_object({'id': 2, 'name': 'bar'})
+    assert cache.preview(single_id)['name'] == 'bar' # type: ignore
+    assert cache.preview(many_id)[1]['name'] == 'bar' # type: ignore
+    assert cache.preview(other_many_id)[0]['name'] == 'bar' # type: ignore
+
+    cache.invalidate_function_cache_object(2)
+    assert single_id not in cache.cache_ids
+    assert cache.preview(many_id) == [{'id': 1, 'name': 'foo'}]
+    assert cache.preview(other_many_id) == [{'id': 3, 'name': 'foo'}]
+    assert 2 not in cache.object_map
+
+    # Callers get their own list back and cannot corrupt the cached result
+    result = await many(1)
+    result.clear()
+    assert cache.preview(many_id) == [{'id': 1, 'name': 'foo'}]
+
+
+def test_entries_expire_with_default_and_per_put_ttl():
+    now = 0.0
+    cache = LRUCache[dict](ttl=10, timer=lambda: now)
+    cache.put('a', {'id': 1})
+    cache.put('b', {'id': 2}, ttl=30)
+    now = 15.0
+    assert cache.get('a') is None
+    assert 'a' not in cache.cache_ids
+    assert cache.get('b') == {'id': 2}
+    now = 31.0
+    assert cache.preview('b') is None
+
+
+def test_periodic_sweep_removes_unread_expired_entries():
+    now = 0.0
+    cache = LRUCache[dict](ttl=5, sweep_interval=60, timer=lambda: now)
+    for n in range(5):
+        cache.put(n, {'id': n})
+    now = 61.0
+    cache.put('fresh', {'id': 'fresh'})
+    assert list(cache.cache_ids) == ['fresh']
+
+
+def test_sweep_caches_clears_idle_caches():
+    now = 0.0
+    cache = LRUCache[dict](ttl=5, sweep_interval=60, timer=lambda: now)
+    cache.put('a', {'id': 'a'})
+    now = 10.0
+    assert sweep_caches() >= 1
+    assert list(cache.cache_ids) == []
+
+
+def test_weight_based_eviction():
+    cache = LRUCache[dict](max_size=None, max_weight=10, sizer=len)
+    cache.put('a', [1, 2, 3, 4])
+    cache.put('b', [1, 2, 3, 4])
+    cache.get('a')
+    cache.put('c', [1, 2, 3, 4])
+    assert set(cache.cache_ids) == {'a', 'c'}
+    assert cache.total_weight == 8
+    cache.clear()
+    assert cache.total_weight == 0 and len(cache.cache_ids) == 0
+
+
+@pytest.mark.asyncio()
+async def test_negative_results_are_cached_for_negative_ttl():
+    now = 0.0
+    cache = LRUCache[dict](timer=lambda: now)
+    calls = 0
+
+    @cache.function(negative_ttl=10)
+    async def missing(n: int):
+        nonlocal calls
+        calls += 1
+        return None
+
+    @cache.function()
+    async def missing_uncached(n: int):
+        nonlocal calls
+        calls += 1
+        return None
+
+    assert await missing(1) is None
+    assert await missing(1) is None
+    assert calls == 1
+    now = 11.0
+    assert await missing(1) is None
+    assert calls == 2
+
+    await missing_uncached(1)
+    await missing_uncached(1)
+    assert calls == 4
+
+    cache.invalidate_negative()
+    await missing(1)
+    assert calls == 5
+
+
+@pytest.mark.asyncio()
+async def test_concurrent_misses_share_one_load():
+    cache = FunctionOperationsCache[dict]('id')
+    calls = 0
+
+    @cache.function()
+    async def some_function_seq(n: int):
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return [{'id': n}, {'id': n + 1}]
+
+    results = await asyncio.gather(*(some_function_seq(1) for _ in range(5)))
+    assert calls == 1
+    assert all(r == [{'id': 1}, {'id': 2}] for r in results)
+    assert len({id(r) for r in results}) == 5
+
+
+@pytest.mark.asyncio()
+async def test_same_named_methods_do_not_collide():
+    cache = LRUCache[dict]()
+
+    class Guilds:
+        @cache.function(class_level=True)
+        async def fetch(self, n: int):
+            return {'kind': 'guild', 'id': n}
+
+    class Channels:
+        @cache.function(class_level=True)
+        async def fetch(self, n: int):
+            return {'kind': 'channel', 'id': n}
+
+    assert (await Guilds().fetch(1))['kind'] == 'guild'
+    assert (await Channels().fetch(1))['kind'] == 'channel'
+    assert (await Guilds().fetch(1))['kind'] == 'guild'
+    assert len(cache._cache) == 2
+
+
+@pytest.mark.asyncio()
+async def test_unhashable_arguments_bypass_cache():
+    cache = LRUCache[list]()
+    calls = 0
+
+    @cache.function()
+    async def total(values: list):
+        nonlocal calls
+        calls += 1
+        return sum(values)
+
+    assert await total([1, 2]) == 3
+    assert await total([1, 2]) == 3
+    assert calls == 2
+    assert len(cache._cache) == 0
+
+
+@pytest.mark.asyncio()
+async def test_custom_key_function():
+    cache = LRUCache[dict]()
+    calls = 0
+
+    @cache.function(key=lambda icao, **_: icao.upper())
+    async def station(icao: str, verbose: bool = False):
+        nonlocal calls
+        calls += 1
+        return {'icao': icao.upper()}
+
+    await station('kdtw')
+    await station('KDTW', verbose=True)
+    assert calls == 1
+
+
+@pytest.mark.asyncio()
+async def test_invalidation_during_load_is_not_overwritten():
+    cache = FunctionOperationsCache[dict]('id')
+    started, release = asyncio.Event(), asyncio.Event()
+    calls = 0
+
+    @cache.function()
+    async def some_function(n: int):
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            started.set()
+            await release.wait()
+        return {'id': n, 'version': calls}
+
+    loading = asyncio.create_task(some_function(1))
+    await started.wait()
+    cache.invalidate_function_cache_object(1)
+    release.set()
+    assert (await loading)['version'] == 1
+    assert len(cache._cache) == 0
+    assert (await some_function(1))['version'] == 2
+    assert (await some_function(1))['version'] == 2
+    assert cache._invalidated == {}
+
+
+@pytest.mark.asyncio()
+async def test_clear_during_load_is_not_overwritten():
+    cache = LRUCache[dict]()
+    started, release = asyncio.Event(), asyncio.Event()
+
+    @cache.function()
+    async def some_function(n: int):
+        started.set()
+        await release.wait()
+        return {'id': n}
+
+    loading = asyncio.create_task(some_function(1))
+    await started.wait()
+    cache.clear()
+    release.set()
+    await loading
+    assert len(cache._cache) == 0
+
+
+@pytest.mark.asyncio()
+async def test_update_keeps_newer_version():
+    cache = FunctionOperationsCache[dict]('id')
+    now = datetime.now(timezone.utc)
+
+    @cache.function()
+    async def some_function_seq(n: int):
+        return [{'id': n, 'name': 'new', 'updated_at': now}]
+
+    await some_function_seq(1)
+    key = cache.last_function_id
+    cache.update_function_cache_object({'id': 1, 'name': 'old', 'updated_at': now - timedelta(seconds=5)})
+    assert cache.preview(key)[0]['name'] == 'new'
+    cache.update_function_cache_object({'id': 1, 'name': 'newer', 'updated_at': now + timedelta(seconds=5)})
+    assert cache.preview(key)[0]['name'] == 'newer'
+
+
+@pytest.mark.asyncio()
+async def test_cached_looks_up_without_calling():
+    cache = FunctionOperationsCache[dict]('id')
+    calls = []
+
+    class Context:
+        @cache.function(class_level=True, negative_ttl=60)
+        async def fetch(self, n: int):
+            calls.append(n)
+            return [{'id': n}] if n else None
+
+    assert Context.fetch.cached(1) is None
+    await Context().fetch(1)
+    await Context().fetch(0)
+    assert Context.fetch.cached(1) == [{'id': 1}]
+    assert Context.fetch.cached(0) is None
+    assert Context.fetch.cached([1]) is None
+    assert calls == [1, 0]
+
+
+@pytest.mark.asyncio()
+async def test_cancelled_caller_does_not_lend_its_context_to_others():
+    cache = FunctionOperationsCache[dict]('id')
+    release = asyncio.Event()
+    started = []
+    cancelled = []
+
+    class Context:
+        def __init__(self, name: str):
+            self.name = name
+            self.open = True
+
+        @cache.function(class_level=True)
+        async def fetch(self, n: int):
+            started.append(self.name)
+            try:
+                await release.wait()
+            except asyncio.CancelledError:
+                cancelled.append(self.name)
+                raise
+            assert self.open
+            return [{'id': n, 'by': self.name}]
+
+    leader, follower = Context('leader'), Context('follower')
+    leader_task = asyncio.ensure_future(leader.fetch(1))
+    follower_task = asyncio.ensure_future(follower.fetch(1))
+    while len(started) < 2:
+        await asyncio.sleep(0)
+    leader_task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await leader_task
+    # The leader's call has unwound before its context (connection) is given back
+    assert cancelled == ['leader']
+    leader.open = False
+    release.set()
+    assert await follower_task == [{'id': 1, 'by': 'follower'}]
+    assert await follower.fetch(1) == [{'id': 1, 'by': 'follower'}]
+    assert started == ['leader', 'follower']
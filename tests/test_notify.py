@@ -0,0 +1,216 @@
+import asyncio
+import json
+
+import pytest
+
+from amelia.data import Pg
+from amelia.notify import NotifyDispatcher
+
+
+@pytest.mark.asyncio()
+async def test_listeners_only_receive_their_tables():
+    dispatcher = NotifyDispatcher()
+    autorole, everything = [], []
+
+    async def on_autorole(*args):
+        autorole.append(args)
+
+    async def on_everything(*args):
+        everything.append(args)
+
+    dispatcher.add_listener(on_autorole, tables=['autorole'])
+    dispatcher.add_listener(on_everything)
+    dispatcher.put('autorole', 'UPDATE', 1)
+    dispatcher.put('metarconfig', 'DELETE', 2)
+    await dispatcher.join()
+    assert autorole == [('autorole', 'UPDATE', 1)]
+    assert everything == [('autorole', 'UPDATE', 1), ('metarconfig', 'DELETE', 2)]
+    await dispatcher.close()
+
+
+@pytest.mark.asyncio()
+async def test_slow_listener_does_not_block_others():
+    dispatcher = NotifyDispatcher(concurrency=1)
+    release = asyncio.Event()
+    fast = []
+
+    async def slow(*_):
+        await release.wait()
+
+    async def quick(*args):
+        fast.append(args)
+
+    dispatcher.add_listener(slow)
+    dispatcher.add_listener(quick)
+    for n in range(3):
+        dispatcher.put('autorole', 'UPDATE', n)
+    for _ in range(10):
+        await asyncio.sleep(0)
+    assert len(fast) == 3
+    release.set()
+    await dispatcher.join()
+    await dispatcher.close()
+
+
+@pytest.mark.asyncio()
+async def test_failures_are_isolated():
+    dispatcher = NotifyDispatcher()
+    seen = []
+
+    async def broken(*_):
+        raise RuntimeError
+
+    async def working(*args):
+        seen.append(args)
+
+    dispatcher.add_listener(broken)
+    dispatcher.add_listener(working)
+    dispatcher.put('autorole', 'DELETE', 1)
+    dispatcher.put('autorole', 'DELETE', 2)
+    await dispatcher.join()
+    assert dispatcher.failures == 2
+    assert len(seen) == 2
+    await dispatcher.close()
+
+
+@pytest.mark.asyncio()
+async def test_bursts_are_coalesced():
+    dispatcher = NotifyDispatcher(concurrency=1)
+    seen = []
+
+    async def listener(*args):
+        seen.append(args)
+
+    dispatcher.add_listener(listener)
+    for _ in range(5):
+        dispatcher.put('autorole', 'UPDATE', 1)
+    dispatcher.put('autorole', 'DELETE', 1)
+    await dispatcher.join()
+    assert seen == [('autorole', 'UPDATE', 1), ('autorole', 'DELETE', 1)]
+    assert dispatcher.coalesced == 4
+    await dispatcher.close()
+
+
+@pytest.mark.asyncio()
+async def test_overflow_flushes():
+    dispatcher = NotifyDispatcher(max_pending=2)
+    flushed = []
+
+    async def listener(*_):
+        pass
+
+    dispatcher.add_listener(listener)
+    dispatcher.add_flush_listener(lambda: flushed.append(True))
+    for n in range(3):
+        dispatcher.put('autorole', 'UPDATE', n)
+    await dispatcher.join()
+    assert dispatcher.overflows == 1
+    assert flushed == [True]
+    await dispatcher.close()
+
+
+@pytest.mark.asyncio()
+async def test_pg_notify_queues_payload():
+    pg = Pg('postgresql://localhost/unused')
+    seen = []
+
+    async def listener(*args):
+        seen.append(args)
+
+    pg.register_listener(listener, tables=['autorole'])
+    pg._notify(None, 1, 'events', json.dumps({'table': 'autorole', 'action': 'INSERT', 'id': 3}))
+    await pg.dispatcher.join()
+    assert seen == [('autorole', 'INSERT', 3)]
+    await pg.dispatcher.close()
+
+
+class FakeConnection:
+
+    def __init__(self):
+        self.closed = False
+        self.healthy = True
+        self.listeners = []
+        self.termination_listeners = []
+
+    def is_closed(self):
+        return self.closed
+
+    def add_termination_listener(self, callback):
+        self.termination_listeners.append(callback)
+
+    def remove_termination_listener(self, callback):
+        self.termination_listeners.remove(callback)
+
+    async def add_listener(self, channel, callback):
+        self.listeners.append(callback)
+
+    async def remove_listener(self, channel, callback):
+        self.listeners.remove(callback)
+
+    async def fetchval(self, query):
+        if not self.healthy:
+            raise OSError
+        return 1
+
+    def drop(self):
+        self.closed = True
+        for callback in self.termination_listeners:
+            callback(self)
+
+    def terminate(self):
+        self.closed = True
+
+    async def close(self):
+        self.closed = True
+
+
+def make_pg(connections):
+    pg = Pg('postgresql://localhost/unused', health_interval=0.01, backoff_base=0.001, backoff_max=0.01)
+
+    async def connect():
+        result = connections.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        pg._polling_conn = result
+        return result
+
+    pg._init_connection = connect
+    return pg
+
+
+@pytest.mark.asyncio()
+async def test_listener_reconnects_and_flushes():
+    first, second = FakeConnection(), FakeConnection()
+    pg = make_pg([first, OSError('refused'), second])
+    flushed = []
+    pg.register_flush_listener(lambda: flushed.append(True))
+    await pg.start_listening()
+    assert pg.metrics()[1] == 'amelia_listener_connected 1'
+    first.drop()
+    for _ in range(100):
+        if pg.reconnects:
+            break
+        await asyncio.sleep(0.01)
+    await pg.dispatcher.join()
+    assert pg.reconnects == 1
+    assert flushed == [True]
+    assert second.listeners == [pg._notify]
+    assert 'amelia_listener_reconnects_total 1' in pg.metrics()
+    await pg.stop_listening()
+    assert second.closed
+    assert pg._polling_conn is None
+
+
+@pytest.mark.asyncio()
+async def test_listener_health_check_detects_dead_connection():
+    first, second = FakeConnection(), FakeConnection()
+    pg = make_pg([first, second])
+    await pg.start_listening()
+    first.healthy = False
+    for _ in range(100):
+        if pg.reconnects:
+            break
+        await asyncio.sleep(0.01)
+    assert pg.reconnects == 1
+    assert first.closed
+    await pg.stop_listening()
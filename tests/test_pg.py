@@ -1,3 +1,4 @@
+import asyncio
 
 import pytest
 
@@ -41,3 +42,60 @@ async def test_pg_context_rollback_on_error(pg):
         assert count == 0
 
 
+
+@pytest.mark.asyncio
+async def test_pg_context_releases_connection_to_pool(pg):
+    async with pg as db:
+        await db.session.execute("create table foo (id serial primary key, name text);")
+        await db.commit()
+    first_pid = None
+    async with pg as db:
+        first_pid = db.session.get_server_pid()
+    async with pg as db:
+        assert db.session.get_server_pid() == first_pid
+    assert pg.pool.get_idle_size() == pg.pool.get_size()
+    await pg.close()
+
+@pytest.mark.asyncio
+async def test_pg_context_is_reentrant(pg):
+    async with pg as db:
+        await db.session.execute("create table foo (id serial primary key, name text);")
+        await db.commit()
+
+    async def insert(name: str, commit: bool):
+        async with pg as db:
+            await db.session.execute("insert into foo (name) values ($1);", name)
+            await asyncio.sleep(0.01)
+            if commit:
+                await db.commit()
+
+    async with pg as outer:
+        await outer.session.execute("insert into foo (name) values ('outer');")
+        async with pg as inner:
+            await inner.session.execute("insert into foo (name) values ('inner');")
+            await inner.commit()
+        await asyncio.gather(insert('a', True), insert('b', False), insert('c', True))
+
+    async with pg as db:
+        names = {r['name'] for r in await db.session.fetch("select name from foo;")}
+        assert names == {'inner', 'a', 'c'}
+    await pg.close()
+
+@pytest.mark.asyncio
+async def test_pg_read_has_no_transaction(pg):
+    async with pg as db:
+        await db.session.execute("create table foo (id serial primary key, name text);")
+        await db.session.execute("insert into foo (name) values ('bar');")
+        await db.commit()
+
+    async with pg.read() as db:
+        assert not db.session.is_in_transaction()
+        count = await db.session.fetchval("select count(id) from foo;")
+        assert count == 1
+        await db.commit()
+
+    async with pg.read(replica=True) as db:
+        count = await db.session.fetchval("select count(id) from foo;")
+        assert count == 1
+    assert pg.pool.get_idle_size() == pg.pool.get_size()
+    await pg.close()
@@ -0,0 +1,54 @@
+import asyncio
+from io import BytesIO
+
+import pytest
+
+from amelia.features.facility.image_cache import PlateImageCache
+
+
+@pytest.mark.asyncio
+async def test_plate_image_cache_round_trip(tmp_path):
+    cache = PlateImageCache(root=tmp_path, max_bytes=1024)
+    assert await cache.get(2310, '00237IL20R.PDF', 200) is None
+    await cache.put(2310, '00237IL20R.PDF', 200, BytesIO(b'png'))
+    image = await cache.get(2310, '00237IL20R.PDF', 200)
+    assert image is not None and image.read() == b'png'
+    # dpi is part of the key
+    assert await cache.get(2310, '00237IL20R.PDF', 100) is None
+
+
+@pytest.mark.asyncio
+async def test_plate_image_cache_drops_old_cycles(tmp_path):
+    cache = PlateImageCache(root=tmp_path, max_bytes=1024)
+    await cache.put(2310, 'A.PDF', 200, BytesIO(b'old'))
+    await cache.put(2311, 'A.PDF', 200, BytesIO(b'new'))
+    assert await cache.get(2310, 'A.PDF', 200) is None
+    assert not (tmp_path / '2310').exists()
+    assert cache.total_bytes == 3
+
+
+@pytest.mark.asyncio
+async def test_plate_image_cache_evicts_least_recently_used(tmp_path):
+    cache = PlateImageCache(root=tmp_path, max_bytes=10)
+    await cache.put(2310, 'A.PDF', 200, BytesIO(b'aaaa'))
+    await cache.put(2310, 'B.PDF', 200, BytesIO(b'bbbb'))
+    await cache.get(2310, 'A.PDF', 200)
+    await cache.put(2310, 'C.PDF', 200, BytesIO(b'cccc'))
+    assert await cache.get(2310, 'B.PDF', 200) is None
+    assert await cache.get(2310, 'A.PDF', 200) is not None
+    assert cache.total_bytes == 8
+
+    # A fresh instance picks the existing files back up
+    reloaded = PlateImageCache(root=tmp_path, max_bytes=10)
+    assert await reloaded.get(2310, 'C.PDF', 200) is not None
+    assert reloaded.total_bytes == 8
+
+
+@pytest.mark.asyncio
+async def test_plate_image_cache_concurrent_puts_of_one_plate(tmp_path):
+    cache = PlateImageCache(root=tmp_path, max_bytes=1024)
+    await asyncio.gather(*(cache.put(2310, 'A.PDF', 200, BytesIO(b'png')) for _ in range(5)))
+    image = await cache.get(2310, 'A.PDF', 200)
+    assert image is not None and image.read() == b'png'
+    assert cache.total_bytes == 3
+    assert [p.name for p in (tmp_path / '2310').iterdir()] == [cache.path_for(2310, 'A.PDF', 200).name]
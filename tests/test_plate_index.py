@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+from amelia.features.facility.index import PlateIndex
+from amelia.tfl import FAAPlate, StationHasNoDataError
+
+
+def make_plate(icao: str, name: str, cycle: int = 2310) -> FAAPlate:
+    return FAAPlate(tpp_cycle=cycle, icao=icao, code='IAP', name=name, pdf_name=f'{name}.PDF', plate_url='')
+
+
+class FakePlates:
+    def __init__(self, plates):
+        self.plates = plates
+        self.calls = 0
+
+    async def all(self, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        if isinstance(self.plates, Exception):
+            raise self.plates
+        return self.plates
+
+
+class FakeTFL:
+    def __init__(self, plates):
+        self.plates = FakePlates(plates)
+
+
+@pytest.mark.asyncio
+async def test_plate_index_is_built_once_and_shared():
+    tfl = FakeTFL([
+        make_plate('KSNA', 'ILS OR LOC RWY 20R'),
+        make_plate('KSNA', 'RNAV (GPS) RWY 20R'),
+        make_plate('KLGB', 'ILS OR LOC RWY 30'),
+    ])
+    index = PlateIndex(tfl) # type: ignore
+    results = await asyncio.gather(index.choices('ksna'), index.choices('KSNA'), index.choices('KLGB'))
+    assert tfl.plates.calls == 1
+    assert [c.name for c in results[0]] == ['ILS OR LOC RWY 20R', 'RNAV (GPS) RWY 20R']
+    assert results[0] == results[1]
+    assert index.tpp_cycle == 2310
+    assert index.icaos == ['KSNA', 'KLGB']
+    assert await index.choices('KXXX') == []
+
+
+@pytest.mark.asyncio
+async def test_failed_refresh_keeps_last_index():
+    tfl = FakeTFL([make_plate('KSNA', 'ILS OR LOC RWY 20R')])
+    index = PlateIndex(tfl) # type: ignore
+    await index.refresh()
+    tfl.plates.plates = StationHasNoDataError()
+    with pytest.raises(StationHasNoDataError):
+        await index.refresh()
+    assert [c.name for c in await index.choices('KSNA')] == ['ILS OR LOC RWY 20R']
+    assert index.icaos == ['KSNA']
@@ -0,0 +1,53 @@
+import asyncio
+import time
+
+import pytest
+
+from amelia.render import RenderService, RenderQueueFullError, RenderTimeoutError
+
+
+def _sleep(seconds: float) -> float:
+    time.sleep(seconds)
+    return seconds
+
+
+@pytest.mark.asyncio
+async def test_render_service_runs_jobs_off_the_loop():
+    renderer = RenderService(max_workers=1, max_queue=2, timeout=5)
+    try:
+        assert await renderer.submit(_sleep, 0) == 0
+        assert renderer.pending == 0
+    finally:
+        renderer.close()
+
+
+@pytest.mark.asyncio
+async def test_render_service_rejects_when_queue_is_full():
+    renderer = RenderService(max_workers=1, max_queue=1, timeout=5)
+    try:
+        first = asyncio.ensure_future(renderer.submit(_sleep, 0.2))
+        await asyncio.sleep(0)
+        with pytest.raises(RenderQueueFullError):
+            await renderer.submit(_sleep, 0)
+        assert await first == 0.2
+    finally:
+        renderer.close()
+
+
+@pytest.mark.asyncio
+async def test_render_service_times_out():
+    renderer = RenderService(max_workers=1, max_queue=1, timeout=0.05)
+    try:
+        with pytest.raises(RenderTimeoutError):
+            await renderer.submit(_sleep, 0.5)
+        # The worker is still busy with the abandoned job, so it still takes up the queue
+        assert renderer.pending == 1
+        with pytest.raises(RenderQueueFullError):
+            await renderer.submit(_sleep, 0)
+        for _ in range(100):
+            if renderer.pending == 0:
+                break
+            await asyncio.sleep(0.05)
+        assert renderer.pending == 0
+    finally:
+        renderer.close()
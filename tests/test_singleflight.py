@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+from amelia.singleflight import SingleFlight
+from amelia.tfl import StationHasNoDataError
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_are_collapsed():
+    flights = SingleFlight()
+    calls = 0
+
+    async def fetch(icao: str):
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return icao.upper()
+
+    results = await asyncio.gather(*(flights.do('ksfo', fetch, 'ksfo') for _ in range(10)))
+    assert calls == 1
+    assert results == ['KSFO'] * 10
+    assert 'ksfo' not in flights
+
+    await flights.do('ksfo', fetch, 'ksfo')
+    assert calls == 2
+
+
+@pytest.mark.asyncio
+async def test_errors_propagate_to_every_waiter():
+    flights = SingleFlight()
+
+    async def fetch():
+        await asyncio.sleep(0.01)
+        raise StationHasNoDataError
+
+    results = await asyncio.gather(*(flights.do('kxxx', fetch) for _ in range(3)), return_exceptions=True)
+    assert all(isinstance(r, StationHasNoDataError) for r in results)
+    assert len(flights) == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_does_not_cancel_others():
+    flights = SingleFlight()
+
+    async def fetch():
+        await asyncio.sleep(0.05)
+        return 1
+
+    impatient = asyncio.ensure_future(asyncio.wait_for(flights.do('k', fetch), timeout=0.01))
+    patient = asyncio.ensure_future(flights.do('k', fetch))
+    with pytest.raises(asyncio.TimeoutError):
+        await impatient
+    assert await patient == 1
+
+
+@pytest.mark.asyncio
+async def test_abandoned_call_is_cancelled_before_the_last_waiter_returns():
+    flights = SingleFlight(cancel_abandoned=True)
+    started = asyncio.Event()
+    unwound = []
+
+    async def fetch():
+        started.set()
+        try:
+            await asyncio.sleep(1)
+        finally:
+            unwound.append(True)
+
+    waiters = [asyncio.ensure_future(flights.do('k', fetch)) for _ in range(2)]
+    await started.wait()
+    waiters[0].cancel()
+    await asyncio.sleep(0)
+    assert not unwound
+    waiters[1].cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiters[1]
+    assert unwound == [True]
+    assert 'k' not in flights
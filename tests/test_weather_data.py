@@ -1,8 +1,11 @@
+from datetime import datetime, timezone
 from typing import Tuple
 import asyncpg
 import pytest
 import pytest_asyncio
-from amelia.features.weather.data import AllowedChannel, WeatherConfigSchema, WeatherDataContext, config_cache
+from amelia.features.weather.data import AllowedChannel, WeatherConfigSchema, WeatherDataContext, config_cache, \
+    WeatherConfigRecord, AllowedChannelRecord, database_change_notify
+from amelia.cache import NEGATIVE
 from amelia.concepts.guild.data import GuildDataContext, GuildSchema
 from polyfactory.factories.pydantic_factory import ModelFactory
 
@@ -161,3 +164,46 @@ async def test_cache_does_not_duplicate_keys(ctx_with_guild_schema: Tuple[Weathe
     hit_key = config_cache.last_function_id
     assert hit_key != channel_key
     assert hit_key == key
+
+
+def test_weather_config_record_from_row():
+    now = datetime.now(timezone.utc)
+    row = {
+        'id': 1, 'guild_id': 2, 'restrict_channel': False, 'delete_interval': 5,
+        'created_at': now, 'updated_at': now
+    }
+    record = WeatherConfigRecord.from_row('metarconfig', row)
+    assert record.guild_id == 2 and record.restrict_channel is False
+    assert record.table == 'metarconfig'
+    assert not hasattr(record, '__dict__')
+
+
+@pytest.mark.asyncio
+async def test_change_notify_only_touches_its_own_table():
+    now = datetime.now(timezone.utc)
+    config = WeatherConfigRecord('metarconfig', 5, 1, True, 5, now, now)
+    channel = AllowedChannelRecord('tafchannel', 5, 2, 123, now, now)
+    config_cache.put('config', config)
+    config_cache.put('channels', [channel])
+    try:
+        await database_change_notify('metarconfig', 'UPDATE', 5)
+        assert config_cache.get('config') is None
+        assert config_cache.get('channels') == [channel]
+    finally:
+        config_cache.clear()
+
+
+@pytest.mark.asyncio
+async def test_config_insert_only_drops_missing_configurations():
+    now = datetime.now(timezone.utc)
+    channel = AllowedChannelRecord('tafchannel', 5, 2, 123, now, now)
+    config_cache.put('channels', [channel])
+    config_cache.put('missing', NEGATIVE)
+    try:
+        await database_change_notify('metarconfig', 'INSERT', 6)
+        assert config_cache.preview('missing') is None
+        assert config_cache.get('channels') == [channel]
+        await database_change_notify('tafchannel', 'INSERT', 6)
+        assert config_cache.get('channels') is None
+    finally:
+        config_cache.clear()
@@ -0,0 +1,41 @@
+from datetime import timedelta
+
+import pytest
+
+from amelia.features.weather import prefetch
+from amelia.features.weather.prefetch import StationDemand, WeatherPrefetch
+
+
+def test_station_demand_ranks_and_decays():
+    now = 0.0
+    demand = StationDemand(half_life=timedelta(seconds=60), min_score=1.0, clock=lambda: now)
+    for _ in range(5):
+        demand.record('kjfk')
+    for _ in range(3):
+        demand.record('KLAX')
+    demand.record('ksna')
+    assert demand.hottest(2) == ['KJFK', 'KLAX']
+
+    # Two half lives later KSNA has decayed below the threshold and is dropped
+    now = 120.0
+    assert demand.score('KJFK') == 5 / 4
+    assert demand.hottest(10) == ['KJFK']
+    assert demand.score('KSNA') == 0.0
+
+
+@pytest.mark.asyncio
+async def test_refresh_continues_after_a_station_fails(monkeypatch):
+    monkeypatch.setattr(prefetch, 'PREFETCH_SPACING', 0)
+    demand = StationDemand(clock=lambda: 0.0)
+    for _ in range(2):
+        demand.record('KJFK')
+    demand.record('KLAX')
+    refreshed = []
+
+    async def fetch(icao, refresh=False):
+        if icao == 'KJFK':
+            raise KeyError('rawOb')
+        refreshed.append(icao)
+
+    await WeatherPrefetch(None)._refresh(demand, fetch) # type: ignore
+    assert refreshed == ['KLAX']